@@ -1,19 +1,12 @@
-from flask import Flask
-from .config import JWT_SECRET
-import firebase_admin
-from firebase_admin import credentials
+from flask import Flask, jsonify
+from .config import JWT_SECRET, MIGRATE_ON_STARTUP
+from .database import db
 
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
     app.config['SECRET_KEY'] = JWT_SECRET
 
-    # Initialize Firebase Admin SDK
-    if not firebase_admin._apps:
-        try:
-            cred = credentials.Certificate("instance/serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
-        except Exception as e:
-            print(f"Error initializing Firebase Admin SDK: {e}")
+    # Firebase Admin SDK is initialized by the notification transport on its first send
 
     from .api import auth, user, beneficiary, cards, transactions, qr
     app.register_blueprint(auth.bp)
@@ -26,4 +19,46 @@ def create_app():
     from .admin import admin_bp
     app.register_blueprint(admin_bp)
 
+    # Bring the schema and indexes up to date
+    from .migrations import migrate, schema_cli
+    if MIGRATE_ON_STARTUP:
+        migrate()
+    app.cli.add_command(schema_cli)
+
+    from .stats import stats_cli
+    app.cli.add_command(stats_cli)
+
+    from .broadcast import broadcast_cli
+    app.cli.add_command(broadcast_cli)
+
+    from .ledger import ledger_cli
+    app.cli.add_command(ledger_cli)
+
+    from .cards import cards_cli
+    app.cli.add_command(cards_cli)
+
+    from .startup import startup_cli
+    app.cli.add_command(startup_cli)
+
+    # Per-endpoint and per-statement timings
+    from . import instrumentation
+    instrumentation.init_app(app)
+
+    # The password hashing pool is saturated
+    from .passwords import HashingBusy
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(error):
+        return jsonify({"error": "Server is busy, please try again shortly"}), 503
+
+    # Liveness probe for the load balancer and benchmarks.startup
+    @app.route('/healthz')
+    def healthz():
+        db.execute("SELECT 1")
+        return jsonify({"status": "ok"})
+
+    # Return each request thread's database connection to the pool
+    @app.teardown_appcontext
+    def release_db_connection(exception=None):
+        db.release()
+
     return app
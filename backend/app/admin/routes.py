@@ -1,13 +1,18 @@
-from flask import render_template, request, redirect, url_for, flash, session
+from flask import render_template, request, redirect, url_for, flash, session, jsonify
 from werkzeug.security import check_password_hash
-from cs50 import SQL
 from functools import wraps
 import secrets
 from app.database import db
+from app.notifications import dispatcher, PushNotification
+from app.utils import auth_cache_stats
+from app.logger import log_event
+from app import instrumentation
+from app import broadcast
+from app import stats
+from app import directory
+from app import clock
 from . import admin_bp
-from datetime import datetime, timedelta
-
-db = SQL("sqlite:///instance/database.db")
+from datetime import datetime
 
 # authentication
 def login_required(f):
@@ -48,41 +53,15 @@ def logout():
 @login_required
 def dashboard():
     # top cards
-    total_users = db.execute("SELECT COUNT(*) FROM users")[0]['COUNT(*)']
-    cards_issued = db.execute("SELECT COUNT(*) FROM cards")[0]['COUNT(*)']
-    total_volume = db.execute("SELECT SUM(balance) AS total_volume FROM users;")[0]['total_volume']
-    total_volume = int(round(total_volume, 2)) if total_volume is not None else 0
-
-    average_transaction = db.execute("SELECT AVG(amount) AS average_transaction FROM transactions;")[0]['average_transaction']
-    average_transaction = round(average_transaction, 2) if average_transaction is not None else 0
+    metrics = stats.dashboard_metrics()
 
     
     # new users
-    query = db.execute("SELECT name, created_at FROM users ORDER BY created_at DESC LIMIT 3;")
+    query = db.execute("SELECT name, created_at, created_at_ms FROM users ORDER BY created_at_ms DESC LIMIT 3;")
+    now_ms = clock.now_ms()
+    created = clock.time_ago([clock.row_ms(user, 'created_at') for user in query], now_ms)
     new_users = []
-    for user in query:
-        created_dt = datetime.strptime(user['created_at'], "%Y-%m-%d %H:%M:%S")
-        
-        # calculating time difference
-        diff = datetime.now() - created_dt
-        days = diff.days
-        seconds = diff.seconds
-
-        # formatting time ago
-        if days >= 30:
-            months = days // 30
-            time_ago = f"{months} month" + ("s" if months > 1 else "")
-        elif days >= 1:
-            time_ago = f"{days} day" + ("s" if days > 1 else "")
-        elif seconds >= 3600:
-            hours = seconds // 3600
-            time_ago = f"{hours} hour" + ("s" if hours > 1 else "")
-        elif seconds >= 60:
-            minutes = seconds // 60
-            time_ago = f"{minutes} minute" + ("s" if minutes > 1 else "")
-        else:
-            time_ago = "just now"
-
+    for user, time_ago in zip(query, created):
         # getting first letters
         words = user['name'].split()
         if len(words) == 1:
@@ -97,90 +76,128 @@ def dashboard():
             'created_at': time_ago
         })
 
-    # recent transactions
-    query = db.execute("SELECT transaction_type, sender_id, receiver_id, amount, timestamp, transaction_id FROM transactions ORDER BY timestamp DESC LIMIT 6;")
+    # recent transactions, with the user's name joined in
+    query = db.execute("""
+        SELECT t.transaction_type, t.amount, t.timestamp, t.timestamp_ms,
+               CASE t.transaction_type WHEN 'sent' THEN s.name ELSE r.name END AS name
+        FROM transactions t
+        LEFT JOIN users s ON t.sender_id = s.id
+        LEFT JOIN users r ON t.receiver_id = r.id
+        WHERE t.transaction_type IN ('sent', 'redeemed')
+        ORDER BY t.timestamp_ms DESC
+        LIMIT 3
+    """)
+    timestamps = [clock.row_ms(user, 'timestamp') for user in query]
     recent_transactions = []
-    for user in query:
-        if len(recent_transactions) >= 3:  # stop after 3 entries
-            break
-        dt = datetime.strptime(user["timestamp"], "%Y-%m-%d %H:%M:%S")
-        time = dt.strftime("%I:%M %p")
-        diff = datetime.now() - dt
-        days = diff.days
-        minute = diff.seconds // 60
-
+    for user, ms, days in zip(query, timestamps, clock.days_ago(timestamps, now_ms)):
         if days == 0:
-            time = time
+            time = clock.format_ms(ms, "%I:%M %p")
         elif days == 1:
             time = f"Yesterday"
         else:
             time = f"{days} days ago"
 
-        if user["transaction_type"] == "sent":
-            name = db.execute("SELECT name FROM users WHERE id = ?", user["sender_id"])[0]
-            recent_transactions.append({
-                "name" : name["name"],
-                "amount" : user["amount"],
-                "time" : time,
-                "type" : "red"
-            })
-        elif user["transaction_type"] == "redeemed":
-            name = db.execute("SELECT name FROM users WHERE id = ?", user["receiver_id"])[0]
-            recent_transactions.append({
-                "name" : name["name"],
-                "amount" : user["amount"],
-                "time" : time,
-                "type" : "green"
-            })
-        else:
-            continue
+        recent_transactions.append({
+            "name" : user["name"],
+            "amount" : user["amount"],
+            "time" : time,
+            "type" : "red" if user["transaction_type"] == "sent" else "green"
+        })
 
     return render_template('admin/dashboard.html',
-    total_users=total_users, 
-    cards_issued=cards_issued, 
-    total_volume=total_volume, 
-    average_transaction=average_transaction,
+    **metrics,
     new_users=new_users,
     recent_transactions=recent_transactions)
 
 
 #users
+USERS_PER_PAGE = 25
+
+USER_SORTS = {
+    'newest': 'created_at_ms DESC, id DESC',
+    'oldest': 'created_at_ms ASC, id ASC',
+    'name': 'name COLLATE NOCASE ASC, id ASC',
+    'balance': 'balance DESC, id DESC',
+    'transactions': 'transaction_count DESC, id DESC',
+}
+
+# 'sent' rows count for the sender and 'redeemed' rows for the receiver
+USER_TRANSACTION_COUNTS = """
+    SELECT user_id, COUNT(*) AS transaction_count FROM (
+        SELECT sender_id AS user_id FROM transactions WHERE transaction_type = 'sent' {sender_filter}
+        UNION ALL
+        SELECT receiver_id AS user_id FROM transactions WHERE transaction_type = 'redeemed' {receiver_filter}
+    ) GROUP BY user_id
+"""
+
 @admin_bp.route('/users')
 @login_required
 def users():
     # top cards
-    total_users = db.execute("SELECT COUNT(*) FROM users")[0]['COUNT(*)']
-    cards_issued = db.execute("SELECT COUNT(*) FROM cards")[0]['COUNT(*)']
-    total_volume = db.execute("SELECT SUM(balance) AS total_volume FROM users;")[0]['total_volume']
-    total_volume = int(round(total_volume, 2)) if total_volume is not None else 0
-    average_transaction = db.execute("SELECT AVG(amount) AS average_transaction FROM transactions;")[0]['average_transaction']
-    average_transaction = round(average_transaction, 2) if average_transaction is not None else 0
-
-    #users
-    users = db.execute("SELECT id, name, email, phone_number, balance, has_card, created_at FROM users;")
-    for user in users:
-        created_dt = datetime.strptime(user['created_at'], "%Y-%m-%d %H:%M:%S")
-        
-        # calculating time difference
-        diff = datetime.now() - created_dt
-        days = diff.days
-        seconds = diff.seconds
-
-        # formatting time ago
-        if days >= 30:
-            months = days // 30
-            time_ago = f"{months} month" + ("s" if months > 1 else "")
-        elif days >= 1:
-            time_ago = f"{days} day" + ("s" if days > 1 else "")
-        elif seconds >= 3600:
-            hours = seconds // 3600
-            time_ago = f"{hours} hour" + ("s" if hours > 1 else "")
-        elif seconds >= 60:
-            minutes = seconds // 60
-            time_ago = f"{minutes} minute" + ("s" if minutes > 1 else "")
-        else:
-            time_ago = "just now"
-
+    metrics = stats.dashboard_metrics()
+
+    # filters, sorting and pagination from the query string
+    search = request.args.get('q', '').strip()
+    card_filter = request.args.get('card', 'all')
+    balance_filter = request.args.get('balance', 'all')
+    sort = request.args.get('sort', 'newest')
+    if sort not in USER_SORTS:
+        sort = 'newest'
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    conditions, params = [], []
+    if search:
+        conditions.append("(name LIKE ? OR email LIKE ? OR phone_number LIKE ?)")
+        params += [f"%{search}%"] * 3
+    if card_filter == 'with-cards':
+        conditions.append("has_card = 1")
+    elif card_filter == 'without-cards':
+        conditions.append("has_card = 0")
+    if balance_filter == 'positive':
+        conditions.append("balance > 0")
+    elif balance_filter == 'zero':
+        conditions.append("balance = 0")
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    matching_users = db.execute(f"SELECT COUNT(*) AS total FROM users {where}", *params)[0]['total']
+    total_pages = max((matching_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE, 1)
+    page = min(page, total_pages)
+    offset = (page - 1) * USERS_PER_PAGE
+
+    #users with their transaction counts in one query
+    order = USER_SORTS[sort]
+    if sort == 'transactions':
+        # ordering by the count needs it for every matching user
+        counts = USER_TRANSACTION_COUNTS.format(sender_filter='', receiver_filter='')
+        users = db.execute(f"""
+            SELECT u.id, u.name, u.email, u.phone_number, u.balance, u.has_card, u.created_at, u.created_at_ms,
+                   COALESCE(tc.transaction_count, 0) AS transaction_count
+            FROM (SELECT * FROM users {where}) u
+            LEFT JOIN ({counts}) tc ON tc.user_id = u.id
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        """, *params, USERS_PER_PAGE, offset)
+    else:
+        # pick the page first, then count transactions for those users only
+        counts = USER_TRANSACTION_COUNTS.format(
+            sender_filter="AND sender_id IN (SELECT id FROM page)",
+            receiver_filter="AND receiver_id IN (SELECT id FROM page)"
+        )
+        users = db.execute(f"""
+            WITH page AS (
+                SELECT id, name, email, phone_number, balance, has_card, created_at, created_at_ms
+                FROM users {where}
+                ORDER BY {order}
+                LIMIT ? OFFSET ?
+            )
+            SELECT page.*, COALESCE(tc.transaction_count, 0) AS transaction_count
+            FROM page
+            LEFT JOIN ({counts}) tc ON tc.user_id = page.id
+            ORDER BY {order}
+        """, *params, USERS_PER_PAGE, offset)
+
+    created = clock.time_ago([clock.row_ms(user, 'created_at') for user in users])
+    for user, time_ago in zip(users, created):
         user["created_at"] = time_ago
 
 
@@ -192,19 +209,16 @@ def users():
             letters = words[0][0] + words[1][0]
         user["letters"] = letters.upper()
 
-        #user transaction count
-        user["transaction_count"] = db.execute(
-            "SELECT COUNT(*) FROM transactions WHERE (transaction_type = 'sent' AND sender_id = ?) OR (transaction_type = 'redeemed' AND receiver_id = ?)", 
-            user["id"], user["id"]
-        )[0]["COUNT(*)"]
-    print(users)
-
     return render_template('admin/users.html',
-    total_users=total_users,
-    cards_issued=cards_issued,
-    total_volume=total_volume,
-    average_transaction=average_transaction,
-    users=users)
+    **metrics,
+    users=users,
+    search=search,
+    card_filter=card_filter,
+    balance_filter=balance_filter,
+    sort=sort,
+    page=page,
+    total_pages=total_pages,
+    matching_users=matching_users)
 
 @admin_bp.route('/users/<int:user_id>')
 @login_required
@@ -240,10 +254,10 @@ def notifications():
     devices_with_tokens = db.execute("SELECT COUNT(*) FROM users WHERE device_token IS NOT NULL")[0]['COUNT(*)']
     
     # Get today's notifications sent
-    today = datetime.now().strftime('%Y-%m-%d')
+    # A range on sent_at_ms instead of DATE(sent_at) so the index is used
     notifications_sent_today = db.execute(
-        "SELECT COUNT(*) FROM notification_logs WHERE DATE(sent_at) = ?", 
-        today
+        "SELECT COUNT(*) FROM notification_logs WHERE sent_at_ms >= ? AND sent_at_ms < ?",
+        *clock.day_bounds_ms()
     )[0]['COUNT(*)']
     
     # Get notification history
@@ -253,15 +267,15 @@ def notifications():
             u.name as recipient_name
         FROM notification_logs nl
         LEFT JOIN users u ON nl.recipient_id = u.id
-        ORDER BY nl.sent_at DESC
+        ORDER BY nl.sent_at_ms DESC
         LIMIT 50
     """)
     
     notification_history = []
     for notif in history_query:
         # Format timestamp
-        dt = datetime.strptime(notif['sent_at'], "%Y-%m-%d %H:%M:%S")
-        time_ago = dt.strftime("%b %d, %I:%M %p")
+        ms = clock.row_ms(notif, 'sent_at')
+        time_ago = clock.format_ms(ms, "%b %d, %I:%M %p") if ms is not None else ''
         
         notification_history.append({
             'title': notif['title'],
@@ -283,19 +297,7 @@ def notifications():
 @admin_bp.route('/notifications/send', methods=['POST'])
 @login_required
 def send_notification():
-    """Send push notification to users"""
-    import firebase_admin
-    from firebase_admin import credentials, messaging
-
-    # Initialize Firebase Admin SDK if not already initialized
-    if not firebase_admin._apps:
-        try:
-            cred = credentials.Certificate("instance/serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
-        except Exception as e:
-            flash('Error initializing Firebase Admin SDK. Make sure serviceAccountKey.json is present in the instance folder.', 'error')
-            return redirect(url_for('admin.notifications'))
-
+    """Queue a push notification for one user or for everyone"""
     title = request.form.get('title')
     message_body = request.form.get('message')
     target_type = request.form.get('target_type')  # 'all' or 'specific'
@@ -324,72 +326,63 @@ def send_notification():
             'message': message_body
         })
         
-        recipient_count = 0
-        status = 'sent'
-        
-        # Define Android specific notification settings
-        android_config = messaging.AndroidConfig(
-            notification=messaging.AndroidNotification(
-                icon='icon',  # User-specified icon name
-                channel_id='default'  # Default channel ID
-            )
+        notification = PushNotification(
+            title=title,
+            body=message_body,
+            data=data_payload,
+            android_icon='icon',  # User-specified icon name
+            android_channel_id='default'  # Default channel ID
         )
 
         if target_type == 'all':
-            # Get all device tokens
-            users = db.execute("SELECT DISTINCT device_token FROM users WHERE device_token IS NOT NULL")
-            device_tokens = [user['device_token'] for user in users]
-            
-            if device_tokens:
-                # Send to multiple devices
-                message = messaging.MulticastMessage(
-                    notification=messaging.Notification(
-                        title=title,
-                        body=message_body,
-                    ),
-                    data=data_payload,
-                    tokens=device_tokens,
-                    android=android_config
-                )
-                response = messaging.send_each_for_multicast(message)
-                recipient_count = response.success_count
-                print(f"DEBUG: Sent notification to {recipient_count} devices. Failures: {response.failure_count}")
-            else:
+            # Tokens are streamed from the database in chunks by the broadcast worker
+            device_count = db.execute("SELECT COUNT(*) AS count FROM users WHERE device_token IS NOT NULL")[0]['count']
+            if not device_count:
                 flash('No devices with tokens found!', 'error')
                 return redirect(url_for('admin.notifications'))
+            broadcast.start(notification)
+            flash(f'Broadcast started for {device_count} device(s)!', 'success')
+            return redirect(url_for('admin.notifications'))
         
-        else:  # specific user
-            user = db.execute("SELECT device_token, name FROM users WHERE id = ?", user_id)
-            if user and user[0]['device_token']:
-                message = messaging.Message(
-                    notification=messaging.Notification(
-                        title=title,
-                        body=message_body,
-                    ),
-                    data=data_payload,
-                    token=user[0]['device_token'],
-                    android=android_config
-                )
-                response = messaging.send(message)
-                recipient_count = 1
-                print(f"DEBUG: Sent notification to {user[0]['name']}. Response: {response}")
-            else:
-                flash('User has no registered device!', 'error')
-                return redirect(url_for('admin.notifications'))
+        # specific user
+        user = db.execute("SELECT device_token, name FROM users WHERE id = ?", user_id)
+        if not user or not user[0]['device_token']:
+            flash('User has no registered device!', 'error')
+            return redirect(url_for('admin.notifications'))
+        device_tokens = [user[0]['device_token']]
         
-        # Log notification
-        db.execute("""
+        # Log notification as queued; workers fill in the delivered count
+        log_id = db.execute("""
             INSERT INTO notification_logs 
-            (title, message, target_type, recipient_id, recipient_count, status, sent_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            (title, message, target_type, recipient_id, recipient_count, status, sent_at, sent_at_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """, title, message_body, target_type, 
             user_id if target_type == 'specific' else None,
-            recipient_count, status, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            0, 'queued', *clock.stamp())
+
+        def on_delivered(results):
+            delivered = sum(1 for result in results if result.success)
+            db.execute("""
+                UPDATE notification_logs
+                SET recipient_count = recipient_count + ?,
+                    status = CASE WHEN recipient_count + ? > 0 THEN 'sent' ELSE 'failed' END
+                WHERE id = ?
+            """, delivered, delivered, log_id)
+            # Forget tokens FCM says will never work again
+            dead = [(user_id, r.token) for r in results if r.error in broadcast.DEAD_TOKEN_ERRORS]
+            if dead:
+                db.executemany("UPDATE users SET device_token = NULL WHERE id = ? AND device_token = ?", dead)
+                directory.invalidate_users([user_id])
+
+        if not dispatcher.enqueue(notification, device_tokens, callback=on_delivered):
+            db.execute("UPDATE notification_logs SET status = 'failed' WHERE id = ?", log_id)
+            flash('Notification queue is full, try again shortly!', 'error')
+            return redirect(url_for('admin.notifications'))
         
-        flash(f'Notification sent successfully to {recipient_count} device(s)!', 'success')
+        flash(f'Notification queued for {len(device_tokens)} device(s)!', 'success')
         
     except Exception as e:
-        print(f"ERROR: Failed to send notification: {e}")
+        log_event('ERROR', f'Failed to send notification: {e}')
         flash(f'Error sending notification: {str(e)}', 'error')
     
     return redirect(url_for('admin.notifications'))
@@ -413,6 +406,15 @@ def coupons():
                          highest_value=highest_value,
                          total_amount=total_amount)
 
+def coupon_limits(form):
+    """Usage cap and expiry from the coupon form; blank means unlimited / never."""
+    max_uses = form.get('max_uses') or None
+    expires_at = form.get('expires_at') or None
+    if expires_at:
+        # <input type="datetime-local"> sends 'YYYY-MM-DDTHH:MM'
+        expires_at = datetime.strptime(expires_at, '%Y-%m-%dT%H:%M').strftime('%Y-%m-%d %H:%M:%S')
+    return (int(max_uses) if max_uses else None), expires_at
+
 @admin_bp.route('/coupons/add', methods=['POST'])
 @login_required
 def add_coupon():
@@ -420,8 +422,9 @@ def add_coupon():
     amount = request.form.get('amount')
     
     try:
-        db.execute("INSERT INTO coupons (coupon_code, amount) VALUES (?, ?)", 
-                   coupon_code, amount)
+        max_uses, expires_at = coupon_limits(request.form)
+        db.execute("INSERT INTO coupons (coupon_code, amount, max_uses, expires_at) VALUES (?, ?, ?, ?)", 
+                   coupon_code, amount, max_uses, expires_at)
         flash(f'Coupon {coupon_code} created successfully!', 'success')
     except Exception as e:
         flash(f'Error: Coupon code already exists!', 'error')
@@ -436,8 +439,9 @@ def edit_coupon():
     amount = request.form.get('amount')
     
     try:
-        db.execute("UPDATE coupons SET coupon_code = ?, amount = ? WHERE id = ?",
-                   coupon_code, amount, coupon_id)
+        max_uses, expires_at = coupon_limits(request.form)
+        db.execute("UPDATE coupons SET coupon_code = ?, amount = ?, max_uses = ?, expires_at = ? WHERE id = ?",
+                   coupon_code, amount, max_uses, expires_at, coupon_id)
         flash(f'Coupon updated successfully!', 'success')
     except Exception as e:
         flash(f'Error updating coupon!', 'error')
@@ -461,3 +465,27 @@ def delete_coupon(coupon_id):
 @login_required
 def settings():
     return render_template('admin/settings.html')
+
+
+# cache metrics
+@admin_bp.route('/metrics/auth-cache')
+@login_required
+def auth_cache_metrics():
+    return jsonify({**auth_cache_stats(), 'directory': directory.cache_stats()})
+
+
+# request and SQL timings
+@admin_bp.route('/metrics')
+@login_required
+def request_metrics():
+    return jsonify(instrumentation.metrics())
+
+
+@admin_bp.route('/metrics/reset', methods=['POST'])
+@login_required
+def reset_request_metrics():
+    """Return the current timings and start collecting from scratch."""
+    snapshot = instrumentation.metrics()
+    if snapshot['enabled']:
+        instrumentation.instrumentation.reset()
+    return jsonify(snapshot)
@@ -1,12 +1,15 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from datetime import datetime, timedelta, timezone
-import pytz
 from ..database import db
 from ..config import JWT_SECRET
-from ..utils import auth_token_required
+from ..utils import auth_token_required, too_many_attempts
+from ..passwords import (
+    hash_password, verify_password, needs_rehash, retry_after,
+    account_limiter, ip_limiter, signup_limiter,
+)
 from ..logger import log_event
+from .. import stats, directory, clock
 
 bp = Blueprint('auth', __name__, url_prefix='/api')
 
@@ -34,14 +37,25 @@ def signup():
     if not password:
         return jsonify({"error": "Password is required"}), 400
     
+    # Every signup attempt costs a hash, so cap them per client
+    ip_key = f"ip:{request.remote_addr}"
+    wait = retry_after((signup_limiter, ip_key))
+    if wait:
+        return too_many_attempts(wait)
+    signup_limiter.hit(ip_key)
+    
     name = name.title()
 
     # Basic email validation
     if '@' not in email or '.' not in email:
         return jsonify({"error": "Invalid email format"}), 400
 
-    # Check if user already exists with the same phone number
-    existing_user = db.execute("SELECT * FROM users WHERE phone_number = ?", phone_number)
+    phone_e164 = directory.normalize_phone(phone_number)
+    if phone_e164 is None:
+        return jsonify({"error": "Invalid phone number"}), 400
+
+    # Check if user already exists with the same phone number, in any format
+    existing_user = db.execute("SELECT id FROM users WHERE phone_e164 = ?", phone_e164)
     if existing_user:
         return jsonify({"error": "User with this phone number account already exists"}), 400
     
@@ -50,16 +64,16 @@ def signup():
     if existing_email:
         return jsonify({"error": "User with this email already exists"}), 400
     
-    hash = generate_password_hash(password)
+    hash = hash_password(password)
     
-    # Get current time in GMT+5 (Pakistan timezone)
-    pk_timezone = pytz.timezone('Asia/Karachi')
-    current_time = datetime.now(pk_timezone).strftime('%Y-%m-%d %H:%M:%S')
+    created_at, created_at_ms = clock.stamp()
 
-    user_id = db.execute(
-        "INSERT INTO users (name, email, phone_number, password, created_at) VALUES (?, ?, ?, ?, ?)", 
-        name, email, phone_number, hash, current_time
-    )
+    with db.transaction():
+        user_id = db.execute(
+            "INSERT INTO users (name, email, phone_number, phone_e164, phone_hash, password, created_at, created_at_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
+            name, email, phone_number, phone_e164, directory.hash_phone(phone_e164), hash, created_at, created_at_ms
+        )
+        stats.increment(users_count=1)
 
     log_event('INFO', f'New user signed up: {name}', user_id=user_id)
 
@@ -101,17 +115,35 @@ def login():
     if not password:
         return jsonify({"error": "Password is required"}), 400
 
+    # Reject rate-limited clients before doing any hashing
+    phone_key = f"phone:{phone_number}"
+    ip_key = f"ip:{request.remote_addr}"
+    wait = retry_after((account_limiter, phone_key), (ip_limiter, ip_key))
+    if wait:
+        log_event('WARNING', f'Rate-limited login attempt for phone: {phone_number}')
+        return too_many_attempts(wait)
+
     existing_user = db.execute("SELECT * FROM users WHERE phone_number = ?", phone_number)
     if not existing_user:
+        account_limiter.hit(phone_key)
+        ip_limiter.hit(ip_key)
         log_event('WARNING', f'Failed login attempt for non-existent user with phone: {phone_number}')
         return jsonify({"error": "User doesn't exist"}), 400
 
     user_id = existing_user[0]["id"]
     hash = existing_user[0]['password']
-    if not check_password_hash(hash, password):
+    if not verify_password(hash, password):
+        account_limiter.hit(phone_key)
+        ip_limiter.hit(ip_key)
         log_event('WARNING', f'Failed login attempt for user: {existing_user[0]["name"]}', user_id=user_id)
         return jsonify({"error": "Incorrect password"}), 400
 
+    account_limiter.reset(phone_key)
+
+    # Upgrade hashes made with older cost parameters while we have the password
+    if needs_rehash(hash):
+        db.execute("UPDATE users SET password = ? WHERE id = ?", hash_password(password), user_id)
+
     payload = {
         "user_id": user_id,
         "type": "auth",
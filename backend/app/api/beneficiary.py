@@ -1,10 +1,18 @@
-from flask import Blueprint, request, jsonify
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from ..database import db
-from ..utils import session_token_required
+from ..utils import session_token_required, too_many_attempts
+from ..config import USERS_MATCH_MAX_BATCH, USERS_MATCH_WINDOW, USERS_MATCH_PER_USER, USERS_MATCH_PER_IP
+from ..passwords import AttemptLimiter, retry_after
 from ..logger import log_event
+from .. import directory, etags
 
 bp = Blueprint('beneficiary', __name__, url_prefix='/api')
 
+# Contact matching answers "is this number registered?" in bulk, so cap it
+match_user_limiter = AttemptLimiter('match_user', USERS_MATCH_PER_USER, USERS_MATCH_WINDOW)
+match_ip_limiter = AttemptLimiter('match_ip', USERS_MATCH_PER_IP, USERS_MATCH_WINDOW)
+
 @bp.route('/add_beneficiary', methods=['POST'])
 @session_token_required
 def add_beneficiary(current_user):
@@ -15,18 +23,13 @@ def add_beneficiary(current_user):
     if not phone_number:
         return jsonify({"error": "Phone number is required"}), 400
 
-    # Extract phone number from IBAN if IBAN format is provided
-    # IBAN format: PK04FLXP0000003XXXXXXXXX where X is the phone (last 11 digits)
-    if phone_number.startswith('PK04FLXP'):
-        phone_number = phone_number[-11:]  # Extract last 11 digits
-
-    # Find the beneficiary user by phone number
-    beneficiary_user = db.execute("SELECT id, name, phone_number FROM users WHERE phone_number = ?", phone_number)
+    # Find the beneficiary user by phone number or FlexPay IBAN
+    beneficiary_user = directory.resolve(phone_number)
 
     if not beneficiary_user:
         return jsonify({"error": "No user found with that phone number"}), 400
 
-    beneficiary_id = beneficiary_user[0]['id']
+    beneficiary_id = beneficiary_user['id']
 
     if user_id == beneficiary_id:
         return jsonify({"error": "You cannot add yourself as a beneficiary"}), 400
@@ -35,20 +38,23 @@ def add_beneficiary(current_user):
     if existing_beneficiary:
         return jsonify({"error": "Beneficiary already exists"}), 400
     
-    db.execute("INSERT INTO beneficiaries (user_id, beneficiary_id) VALUES (?, ?)", user_id, beneficiary_id)
+    with db.transaction():
+        db.execute("INSERT INTO beneficiaries (user_id, beneficiary_id) VALUES (?, ?)", user_id, beneficiary_id)
+        etags.bump(user_id)
     
     log_event('INFO', f'User {user_id} added beneficiary {beneficiary_id}', user_id=user_id)
     
     return jsonify({
         "message": "Beneficiary Added Successfully",
         "beneficiary": {
-            "name": beneficiary_user[0]['name'],
-            "phone_number": beneficiary_user[0]['phone_number']
+            "name": beneficiary_user['name'],
+            "phone_number": beneficiary_user['phone_number']
         }
     })
 
 @bp.route('/beneficiaries', methods=['GET'])
 @session_token_required
+@etags.conditional
 def get_beneficiaries(current_user):
     user_id = current_user['id']
     
@@ -65,13 +71,49 @@ def search_user(current_user):
     if not query:
         return jsonify({"user": None})
 
-    user_data = db.execute(
-        "SELECT name, phone_number FROM users WHERE phone_number = ? AND id != ?",
-        query, user_id
-    )
+    user_data = directory.resolve(query)
 
-    if user_data:
-        return jsonify({"user": user_data[0]})
+    if user_data and user_data['id'] != user_id:
+        return jsonify({"user": {"name": user_data['name'], "phone_number": user_data['phone_number']}})
 
     return jsonify({"user": None})
 
+@bp.route('/users/match', methods=['POST'])
+@session_token_required
+def match_users(current_user):
+    """Which of the uploaded contacts are FlexPay users; only matches are returned."""
+    data = request.get_json(silent=True) or {}
+    phones = data.get('phone_numbers') or []
+    hashes = data.get('phone_hashes') or []
+    user_id = current_user['id']
+
+    if not isinstance(phones, list) or not isinstance(hashes, list):
+        return jsonify({"error": "phone_numbers and phone_hashes must be lists"}), 400
+
+    if not phones and not hashes:
+        return jsonify({"error": "Phone numbers or phone hashes are required"}), 400
+
+    if len(phones) + len(hashes) > USERS_MATCH_MAX_BATCH:
+        return jsonify({"error": f"At most {USERS_MATCH_MAX_BATCH} numbers per request"}), 413
+
+    user_key = f"user:{user_id}"
+    ip_key = f"ip:{request.remote_addr}"
+    wait = retry_after((match_user_limiter, user_key), (match_ip_limiter, ip_key))
+    if wait:
+        log_event('WARNING', f'Rate-limited contact match for user_id: {user_id}', user_id=user_id)
+        return too_many_attempts(wait)
+    match_user_limiter.hit(user_key)
+    match_ip_limiter.hit(ip_key)
+
+    def generate():
+        # Matches are written out batch by batch instead of building one big list
+        yield '{"matches": ['
+        separator = ''
+        for kind, value, user in directory.match(phones, hashes):
+            if user['id'] == user_id:
+                continue
+            yield separator + json.dumps({kind: value, "name": user['name'], "phone_number": user['phone_number']})
+            separator = ', '
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
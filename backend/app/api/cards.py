@@ -1,24 +1,11 @@
 from flask import Blueprint, jsonify, request
-from faker import Faker
 from ..database import db
 from ..utils import session_token_required
 from ..logger import log_event
+from .. import stats, cards, etags
 
 bp = Blueprint('cards', __name__, url_prefix='/api')
 
-# function for generation unique card
-def generate_unique_card_number(card_type):
-    fake = Faker()
-
-    while True:
-        number = fake.credit_card_number(card_type=card_type)
-        existing = db.execute(
-            "SELECT id FROM cards WHERE card_number = ?", number
-        )
-        if not existing:
-            return number
-
-
 @bp.route('/has_card', methods=['POST'])
 @session_token_required
 def has_card(current_user):
@@ -45,34 +32,12 @@ def get_card(current_user):
     if not chosen_card_type:
         return jsonify({"error": "Missing cardType in request body"}), 400
 
-    # check if user has card
-    user = db.execute("SELECT has_card FROM users WHERE id = ?", user_id)
-    if user and user[0]['has_card']:
-        return jsonify({"error": "User Already has a Card"}), 409
-    
-
-    # making fake card details
-    fake = Faker()
-    card_type_map = {
-        "Mastercard": "mastercard",
-        "Visa": "visa",
-        "American Express": "amex"
-    }
-    
-    card_type_param = card_type_map.get(chosen_card_type)
-
-    if not card_type_param:
+    if chosen_card_type not in cards.CARD_TYPES:
         return jsonify({"error": "Invalid Card Type"}), 400
 
-    card_number = generate_unique_card_number(card_type_param)
-    cvc = fake.credit_card_security_code(card_type=card_type_param)
-    expiry_date = fake.credit_card_expire()
-    
-    # adding card flag to databse
-    db.execute("UPDATE users SET has_card = 1 WHERE id = ?", user_id)
-
-    #adding card details to database
-    db.execute("INSERT INTO cards (user_id, card_number, cvc, expiry_date, card_type) VALUES (?, ?, ?, ?, ?)", user_id, card_number, cvc, expiry_date, chosen_card_type)
+    # Checked and issued in one transaction, so two requests cannot both get a card
+    if not cards.issue(user_id, chosen_card_type):
+        return jsonify({"error": "User Already has a Card"}), 409
 
     log_event('INFO', f'New card created for user_id: {user_id}, type: {chosen_card_type}', user_id=user_id)
     return jsonify({"message": f"Card type '{chosen_card_type}' created successfully"}), 201
@@ -133,7 +98,9 @@ def freeze_card(current_user):
         return jsonify({"error": "No card found for this user"}), 404
     
     # Update card frozen status
-    db.execute("UPDATE cards SET is_frozen = ? WHERE user_id = ?", 1 if is_frozen else 0, user_id)
+    with db.transaction():
+        db.execute("UPDATE cards SET is_frozen = ? WHERE user_id = ?", 1 if is_frozen else 0, user_id)
+        etags.bump(user_id)
     
     status = "frozen" if is_frozen else "unfrozen"
     log_event('INFO', f'Card {status} for user_id: {user_id}', user_id=user_id)
@@ -149,11 +116,14 @@ def delete_card(current_user):
     if not card:
         return jsonify({"error": "No card found for this user"}), 404
     
-    # Delete the card
-    db.execute("DELETE FROM cards WHERE user_id = ?", user_id)
-    
-    # Update user has_card flag
-    db.execute("UPDATE users SET has_card = 0 WHERE id = ?", user_id)
+    with db.transaction():
+        # Delete the card
+        deleted = db.execute("DELETE FROM cards WHERE user_id = ?", user_id)
+        
+        # Update user has_card flag
+        db.execute("UPDATE users SET has_card = 0 WHERE id = ?", user_id)
+        stats.increment(cards_count=-deleted)
+        etags.bump(user_id)
     
     log_event('INFO', f'Card deleted for user_id: {user_id}', user_id=user_id)
     return jsonify({"message": "Card deleted successfully"}), 200
\ No newline at end of file
@@ -1,12 +1,12 @@
 from flask import Blueprint, request, jsonify
 from ..utils import auth_token_required, session_token_required
 from ..logger import log_event
-import json
+from .. import qr_scans, directory
 
 bp = Blueprint('qr', __name__, url_prefix='/api')
 
-# Store QR scan history (in production, save to database)
-qr_scans = []
+QR_SCANS_PAGE_SIZE = 20
+QR_SCANS_MAX_PAGE_SIZE = 100
 
 @bp.route('/qr-decode', methods=['POST'])
 @auth_token_required
@@ -25,15 +25,8 @@ def decode_qr(current_user):
     if not raw_data:
         return jsonify({"error": "raw_data is required"}), 400
     
-    # Log the scan
-    qr_record = {
-        'user_id': user_id,
-        'raw_data': raw_data,
-        'parsed_data': parsed_data,
-        'timestamp': timestamp,
-    }
-    
-    qr_scans.append(qr_record)
+    # Store the scan
+    qr_record = qr_scans.add_scan(user_id, raw_data, parsed_data, timestamp)
     
     log_event('INFO', f'QR code scanned by user {user_id}: {raw_data}', user_id=user_id)
     
@@ -55,14 +48,20 @@ def decode_qr(current_user):
 @bp.route('/qr-scans', methods=['GET'])
 @session_token_required
 def get_qr_scans(current_user):
-    """Get all QR scans for the current user"""
+    """Get one page of the current user's QR scans, newest first"""
     user_id = current_user['id']
     
-    user_scans = [scan for scan in qr_scans if scan['user_id'] == user_id]
+    limit = request.args.get('limit', QR_SCANS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, QR_SCANS_MAX_PAGE_SIZE))
+    before_id = request.args.get('before_id', type=int)
+    
+    user_scans = qr_scans.list_scans(user_id, before_id, limit)
+    next_before_id = user_scans[-1]['id'] if len(user_scans) == limit else None
     
     return jsonify({
         "scans": user_scans,
         "count": len(user_scans),
+        "next_before_id": next_before_id,
     })
 
 
@@ -72,13 +71,11 @@ def get_latest_qr_scan(current_user):
     """Get the latest QR scan for the current user"""
     user_id = current_user['id']
     
-    user_scans = [scan for scan in qr_scans if scan['user_id'] == user_id]
+    latest_scan = qr_scans.latest_scan(user_id)
     
-    if not user_scans:
+    if not latest_scan:
         return jsonify({"error": "No scans found"}), 404
     
-    latest_scan = user_scans[-1]
-    
     return jsonify({"latest_scan": latest_scan})
 
 
@@ -86,8 +83,6 @@ def get_latest_qr_scan(current_user):
 @auth_token_required
 def verify_user(current_user):
     """Verify if a user exists by phone number from scanned QR code"""
-    from ..database import db
-    
     data = request.get_json()
     
     if not data:
@@ -98,20 +93,13 @@ def verify_user(current_user):
     if not phone:
         return jsonify({"error": "Phone number is required"}), 400
     
-    # Debug logging
-    print(f"DEBUG: Verifying user with phone: {phone}")
-    
     # Check if user exists in database
-    user = db.execute("SELECT id, name, phone_number FROM users WHERE phone_number = ?", phone)
-    
-    print(f"DEBUG: Query result: {user}")
+    user_data = directory.resolve(phone)
     
-    if not user:
+    if not user_data:
         log_event('INFO', f'QR scan verification failed - user not found: {phone}', user_id=current_user['id'])
         return jsonify({"error": "User not found. This QR code is invalid or the user has deleted their account."}), 404
     
-    user_data = user[0]
-    
     log_event('INFO', f'QR scan verification successful - user found: {user_data["name"]}', user_id=current_user['id'])
     
     return jsonify({
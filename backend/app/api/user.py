@@ -1,13 +1,15 @@
 from flask import Blueprint, jsonify, request
-from werkzeug.security import generate_password_hash, check_password_hash
 from ..database import db
-from ..utils import auth_token_required, session_token_required
+from ..utils import auth_token_required, session_token_required, invalidate_user, too_many_attempts
+from ..passwords import hash_password, verify_password, retry_after, account_limiter
 from ..logger import log_event
+from .. import stats, directory, etags, ledger
 
 bp = Blueprint('user', __name__, url_prefix='/api')
 
 @bp.route('/balance')
 @session_token_required
+@etags.conditional
 def get_balance(current_user):
     user_id = current_user['id']
     balance = db.execute("SELECT balance FROM users WHERE id = ?", user_id)
@@ -18,6 +20,7 @@ def get_balance(current_user):
 
 @bp.route('/profile', methods=['GET'])
 @session_token_required
+@etags.conditional
 def get_profile(current_user):
     user_id = current_user['id']
     user = db.execute("SELECT name, phone_number, email FROM users WHERE id = ?", user_id)
@@ -44,8 +47,12 @@ def update_profile(current_user):
     if not phone:
         return jsonify({"error": "Phone number is required"}), 400
     
-    # Check if phone number is already taken by another user
-    existing_phone = db.execute("SELECT id FROM users WHERE phone_number = ? AND id != ?", phone, user_id)
+    phone_e164 = directory.normalize_phone(phone)
+    if phone_e164 is None:
+        return jsonify({"error": "Invalid phone number"}), 400
+    
+    # Check if phone number is already taken by another user, in any format
+    existing_phone = db.execute("SELECT id FROM users WHERE phone_e164 = ? AND id != ?", phone_e164, user_id)
     if existing_phone:
         return jsonify({"error": "Phone number already in use"}), 400
     
@@ -58,7 +65,14 @@ def update_profile(current_user):
             return jsonify({"error": "Email already in use"}), 400
     
     # Update user information
-    db.execute("UPDATE users SET name = ?, phone_number = ?, email = ? WHERE id = ?", name, phone, email, user_id)
+    with db.transaction():
+        db.execute("UPDATE users SET name = ?, phone_number = ?, phone_e164 = ?, phone_hash = ?, email = ? WHERE id = ?",
+                   name, phone, phone_e164, directory.hash_phone(phone_e164), email, user_id)
+        # Other users see the name and number in their beneficiaries and history
+        etags.bump(user_id)
+        etags.bump_related(user_id)
+    invalidate_user(user_id)
+    directory.invalidate(current_user['phone_number'], phone_e164)
     
     log_event('INFO', f'User profile updated for user_id: {user_id}', user_id=user_id)
     return jsonify({"message": "Profile updated successfully"})
@@ -77,6 +91,11 @@ def change_password(current_user):
     if len(new_password) < 6:
         return jsonify({"error": "New password must be at least 6 characters"}), 400
     
+    account_key = f"user:{user_id}"
+    wait = retry_after((account_limiter, account_key))
+    if wait:
+        return too_many_attempts(wait)
+    
     # Get current password hash
     user = db.execute("SELECT password FROM users WHERE id = ?", user_id)
     if not user:
@@ -85,12 +104,13 @@ def change_password(current_user):
     current_hash = user[0]['password']
     
     # Check if the old password is correct
-    if not check_password_hash(current_hash, old_password):
+    if not verify_password(current_hash, old_password):
+        account_limiter.hit(account_key)
         log_event('WARNING', f'Failed password change attempt for user_id: {user_id}', user_id=user_id)
         return jsonify({"error": "Incorrect old password"}), 400
     
     # Hash and update new password
-    new_hash = generate_password_hash(new_password)
+    new_hash = hash_password(new_password)
     db.execute("UPDATE users SET password = ? WHERE id = ?", new_hash, user_id)
     
     log_event('INFO', f'User password changed for user_id: {user_id}', user_id=user_id)
@@ -102,11 +122,42 @@ def delete_account(current_user):
     user_id = current_user['id']
     
     try:
-        # Delete from all related tables
-        db.execute("DELETE FROM transactions WHERE sender_id = ? OR receiver_id = ?", user_id, user_id)
-        db.execute("DELETE FROM beneficiaries WHERE user_id = ? OR beneficiary_id = ?", user_id, user_id)
-        db.execute("DELETE FROM cards WHERE user_id = ?", user_id)
-        db.execute("DELETE FROM users WHERE id = ?", user_id)
+        with db.transaction(immediate=True):
+            # What the deletion removes from the dashboard counters
+            # sender_id of a 'redeemed' row is a coupon id, not a user
+            removed = db.execute(
+                "SELECT COUNT(*) AS count, COALESCE(SUM(amount), 0) AS amount FROM transactions "
+                "WHERE (sender_id = ? AND transaction_type != 'redeemed') OR receiver_id = ?",
+                user_id, user_id
+            )[0]
+            balance = db.execute("SELECT balance FROM users WHERE id = ?", user_id)[0]['balance']
+
+            # Their beneficiary lists and histories lose this user's rows
+            etags.bump_related(user_id)
+
+            # Delete from all related tables
+            db.execute("DELETE FROM user_versions WHERE user_id = ?", user_id)
+            ledger.record_removal(user_id, f"account {user_id} deleted")
+            db.execute(
+                "DELETE FROM transactions WHERE (sender_id = ? AND transaction_type != 'redeemed') OR receiver_id = ?",
+                user_id, user_id
+            )
+            db.execute("DELETE FROM beneficiaries WHERE user_id = ? OR beneficiary_id = ?", user_id, user_id)
+            db.execute("DELETE FROM coupon_redemptions WHERE user_id = ?", user_id)
+            db.execute("DELETE FROM qr_scans WHERE user_id = ?", user_id)
+            # The audit trail is kept, detached from the account
+            db.execute("UPDATE logs SET user_id = NULL WHERE user_id = ?", user_id)
+            cards_deleted = db.execute("DELETE FROM cards WHERE user_id = ?", user_id)
+            db.execute("DELETE FROM users WHERE id = ?", user_id)
+            stats.increment(
+                users_count=-1,
+                cards_count=-cards_deleted,
+                balance_total=-balance,
+                transactions_count=-removed['count'],
+                transactions_amount_total=-removed['amount']
+            )
+        invalidate_user(user_id)
+        directory.invalidate(current_user['phone_number'])
         
         log_event('INFO', f'User account deleted for user_id: {user_id}', user_id=user_id)
         return jsonify({"message": "Account deleted successfully"})
@@ -145,6 +196,8 @@ def update_device_token(current_user):
         return jsonify({"error": "Device token is required"}), 400
 
     db.execute("UPDATE users SET device_token = ? WHERE id = ?", device_token, user_id)
+    invalidate_user(user_id)
+    directory.invalidate(current_user['phone_number'])
     log_event('INFO', f'Device token updated for user_id: {user_id}', user_id=user_id)
     return jsonify({"message": "Device token updated successfully"})
 
@@ -0,0 +1,172 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from .database import db
+from . import directory, clock
+from .logger import log_event
+from .notifications import dispatcher, PushNotification
+from .config import BROADCAST_CHUNK_SIZE, BROADCAST_CONCURRENCY, BROADCAST_LEASE
+
+# Per-token errors meaning the token will never work again
+DEAD_TOKEN_ERRORS = ('UnregisteredError', 'SenderIdMismatchError')
+
+
+def create(notification):
+    """Record a broadcast to every registered device and return its notification_logs id."""
+    payload = json.dumps({
+        'data': notification.data,
+        'android_icon': notification.android_icon,
+        'android_channel_id': notification.android_channel_id,
+    })
+    return db.execute(
+        "INSERT INTO notification_logs "
+        "(title, message, target_type, recipient_id, recipient_count, status, sent_at, sent_at_ms, payload, cursor_user_id) "
+        "VALUES (?, ?, 'all', NULL, 0, 'queued', ?, ?, ?, 0)",
+        notification.title, notification.body, *clock.stamp(), payload
+    )
+
+
+def start(notification):
+    """Create a broadcast and send it from a background thread."""
+    log_id = create(notification)
+    threading.Thread(target=run, args=(log_id,), name='broadcast', daemon=True).start()
+    return log_id
+
+
+def _claim(log_id):
+    # A lease keeps two processes from sending the same broadcast at once
+    now = time.time()
+    return db.execute(
+        "UPDATE notification_logs SET status = 'sending', lease_until = ? "
+        "WHERE id = ? AND finished_at IS NULL AND payload IS NOT NULL "
+        "AND (lease_until IS NULL OR lease_until < ?)",
+        now + BROADCAST_LEASE, log_id, now
+    ) == 1
+
+
+def _next_chunk(after_user_id):
+    """Up to one chunk of (user_id, token) pairs after the cursor, by keyset on users.id."""
+    return db.query(
+        "SELECT id, device_token FROM users WHERE device_token IS NOT NULL AND id > ? ORDER BY id LIMIT ?",
+        after_user_id, BROADCAST_CHUNK_SIZE, row_factory='tuple'
+    )
+
+
+def run(log_id):
+    """
+    Send (or resume) a broadcast. Tokens are read in chunks after the
+    stored cursor; BROADCAST_CONCURRENCY chunks are sent at a time, and
+    after each window the cursor, counters and dead-token cleanup are
+    committed together. A crash therefore resends at most one window.
+    Returns False if another process holds the broadcast.
+    """
+    if not _claim(log_id):
+        return False
+    try:
+        row = db.execute("SELECT * FROM notification_logs WHERE id = ?", log_id)[0]
+        payload = json.loads(row['payload'])
+        notification = PushNotification(
+            row['title'], row['message'], data=payload['data'],
+            android_icon=payload['android_icon'], android_channel_id=payload['android_channel_id'],
+        )
+        cursor = row['cursor_user_id'] or 0
+
+        with ThreadPoolExecutor(BROADCAST_CONCURRENCY, thread_name_prefix='broadcast-send') as pool:
+            while True:
+                window = []
+                last_full = True
+                while len(window) < BROADCAST_CONCURRENCY and last_full:
+                    chunk = _next_chunk(window[-1][-1][0] if window else cursor)
+                    if chunk:
+                        window.append(chunk)
+                    last_full = len(chunk) == BROADCAST_CHUNK_SIZE
+                if not window:
+                    break
+
+                results = list(pool.map(
+                    lambda chunk: dispatcher.deliver(notification, [token for _, token in chunk]),
+                    window
+                ))
+                delivered = failed = 0
+                dead = []
+                for chunk, chunk_results in zip(window, results):
+                    for user_id, token in chunk:
+                        result = chunk_results[token]
+                        if result.success:
+                            delivered += 1
+                        else:
+                            failed += 1
+                            if result.error in DEAD_TOKEN_ERRORS:
+                                dead.append((user_id, token))
+                cursor = window[-1][-1][0]
+
+                with db.transaction():
+                    if dead:
+                        db.executemany("UPDATE users SET device_token = NULL WHERE id = ? AND device_token = ?", dead)
+                    db.execute(
+                        "UPDATE notification_logs SET cursor_user_id = ?, chunks_done = chunks_done + ?, "
+                        "recipient_count = recipient_count + ?, failed_count = failed_count + ?, "
+                        "pruned_count = pruned_count + ?, lease_until = ? WHERE id = ?",
+                        cursor, len(window), delivered, failed, len(dead), time.time() + BROADCAST_LEASE, log_id
+                    )
+                if dead:
+                    directory.invalidate_users(user_id for user_id, _ in dead)
+                if not last_full:
+                    break
+
+        db.execute(
+            "UPDATE notification_logs SET status = CASE WHEN recipient_count > 0 THEN 'sent' ELSE 'failed' END, "
+            "finished_at = ?, lease_until = NULL WHERE id = ?",
+            clock.now_text(), log_id
+        )
+        return True
+    except Exception as e:
+        # Keep the cursor and drop the lease so the broadcast can be resumed
+        db.execute("UPDATE notification_logs SET lease_until = NULL WHERE id = ?", log_id)
+        log_event('ERROR', f'Broadcast {log_id} stopped: {e}')
+        raise
+    finally:
+        db.release()
+
+
+def unfinished():
+    return db.execute(
+        "SELECT id, title, status, chunks_done, recipient_count, failed_count, pruned_count, cursor_user_id "
+        "FROM notification_logs WHERE target_type = 'all' AND finished_at IS NULL AND payload IS NOT NULL "
+        "ORDER BY id"
+    )
+
+
+@click.group('broadcast')
+def broadcast_cli():
+    """Admin broadcast notifications."""
+
+
+@broadcast_cli.command('status')
+def status_command():
+    """List broadcasts that have not finished."""
+    rows = unfinished()
+    for row in rows:
+        click.echo(
+            f"{row['id']}: {row['title']!r} {row['status']}, {row['chunks_done']} chunks done, "
+            f"{row['recipient_count']} delivered, {row['failed_count']} failed, "
+            f"{row['pruned_count']} tokens pruned, resume after user {row['cursor_user_id']}"
+        )
+    if not rows:
+        click.echo("No unfinished broadcasts.")
+
+
+@broadcast_cli.command('resume')
+@click.argument('log_id', type=int, required=False)
+def resume_command(log_id):
+    """Resume one broadcast, or every unfinished one."""
+    ids = [log_id] if log_id else [row['id'] for row in unfinished()]
+    for broadcast_id in ids:
+        if run(broadcast_id):
+            click.echo(f"Broadcast {broadcast_id} finished.")
+        else:
+            click.echo(f"Broadcast {broadcast_id} is finished or running elsewhere.")
+    if not ids:
+        click.echo("No unfinished broadcasts.")
@@ -0,0 +1,102 @@
+import hashlib
+import secrets
+from datetime import date
+from .config import DATABASE_PATH, CARD_NUMBER_KEY, TXN_ID_KEY, JWT_SECRET
+from .txn_ids import reserve
+
+# Issuer prefixes and number length per network; new numbers use the first
+# prefix as their BIN, the others are the network's remaining ranges
+NETWORKS = {
+    'visa': (('4',), 16),
+    'mastercard': (tuple(str(p) for p in range(51, 56)) + tuple(str(p) for p in range(2221, 2721)), 16),
+    'amex': (('34', '37'), 15),
+}
+SECURITY_CODE_LENGTHS = {'visa': 3, 'mastercard': 3, 'amex': 4}
+VALIDITY_YEARS = 5
+ROUNDS = 4
+
+# Luhn doubles every second digit from the right; DOUBLED[d] is 2d with its digits summed
+DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+# One permutation key per network, so the networks' sequences scramble differently
+_secret = (CARD_NUMBER_KEY or TXN_ID_KEY or JWT_SECRET or 'flexpay').encode()
+_keys = {network: hashlib.sha256(_secret + network.encode()).digest() for network in NETWORKS}
+
+
+def luhn_check_digit(partial):
+    """The digit that makes `partial` + digit pass the Luhn check."""
+    total = 0
+    for position, char in enumerate(reversed(partial)):
+        digit = ord(char) - 48
+        # Once the check digit is appended, these positions are the doubled ones
+        total += DOUBLED[digit] if position % 2 == 0 else digit
+    return str(-total % 10)
+
+
+def is_luhn_valid(number):
+    number = number.replace(' ', '')
+    return number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def _permute(value, key, bits):
+    """Keyed Feistel bijection on [0, 2**bits), bits even."""
+    half_bits = bits // 2
+    mask = (1 << half_bits) - 1
+    size = (half_bits + 7) // 8
+    left, right = value >> half_bits, value & mask
+    for round_number in range(ROUNDS):
+        digest = hashlib.blake2b(right.to_bytes(size, 'big'), key=key, digest_size=8, person=bytes([round_number]) * 16).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+    return (left << half_bits) | right
+
+
+def account_digits(network, sequence_value):
+    """
+    The account part of the `sequence_value`-th card of a network. The
+    Feistel network permutes a power-of-two range, so values past 10**digits
+    are walked through it again until they land inside; that keeps it a
+    bijection on the decimal range, and distinct sequence values give
+    distinct numbers.
+    """
+    prefixes, length = NETWORKS[network]
+    digits = length - len(prefixes[0]) - 1
+    space = 10 ** digits
+    if sequence_value >= space:
+        raise RuntimeError(f"{network} card number space exhausted")
+    bits = (space - 1).bit_length()
+    bits += bits % 2
+    key = _keys[network]
+    value = _permute(sequence_value, key, bits)
+    while value >= space:
+        value = _permute(value, key, bits)
+    return f"{value:0{digits}d}"
+
+
+def card_numbers(network, count):
+    """
+    `count` new Luhn-valid numbers for 'visa', 'mastercard' or 'amex'.
+    They come from a per-network sequence in id_sequences, scrambled by a
+    keyed permutation, so they never repeat and no lookup is needed.
+    """
+    prefix = NETWORKS[network][0][0]
+    start, end = reserve(DATABASE_PATH, f'card_number:{network}', count)
+    numbers = []
+    for value in range(start, end):
+        partial = prefix + account_digits(network, value)
+        numbers.append(partial + luhn_check_digit(partial))
+    return numbers
+
+
+def card_number(network):
+    return card_numbers(network, 1)[0]
+
+
+def security_code(network):
+    length = SECURITY_CODE_LENGTHS[network]
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
+
+
+def expiry_date(today=None):
+    """'MM/YY', VALIDITY_YEARS from this month."""
+    today = today or date.today()
+    return f"{today.month:02d}/{(today.year + VALIDITY_YEARS) % 100:02d}"
@@ -0,0 +1,85 @@
+import click
+from .database import db
+from . import stats, card_numbers, etags
+
+# cards.card_type as the app shows it, and the network it is issued on
+CARD_TYPES = {
+    "Mastercard": "mastercard",
+    "Visa": "visa",
+    "American Express": "amex",
+}
+
+# Users looked up per query, below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+
+
+def _without_card(user_ids):
+    eligible = []
+    for i in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[i:i + CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        eligible += [row[0] for row in db.query(
+            f"SELECT id FROM users WHERE id IN ({placeholders}) AND NOT has_card ORDER BY id",
+            *chunk, row_factory='tuple'
+        )]
+    return eligible
+
+
+def issue_many(user_ids, card_type):
+    """
+    Issue a `card_type` card to every user in `user_ids` that exists and has
+    none yet, with one card number reservation and one transaction for the
+    whole batch. Returns the ids of the users that got a card.
+
+    Numbers from the permuted sequence never repeat, but cards issued before
+    it were random; a user whose new number one of those already holds is
+    retried with a fresh one in another round.
+    """
+    network = CARD_TYPES[card_type]
+    expiry_date = card_numbers.expiry_date()
+    issued = []
+    pending = _without_card(list(dict.fromkeys(user_ids)))
+    while pending:
+        # Reserved on its own connection, so before the write lock is taken
+        numbers = card_numbers.card_numbers(network, len(pending))
+        with db.transaction(immediate=True):
+            done, taken = [], []
+            for user_id, number in zip(_without_card(pending), numbers):
+                inserted = db.execute(
+                    "INSERT INTO cards (user_id, card_number, cvc, expiry_date, card_type) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (card_number) DO NOTHING RETURNING id",
+                    user_id, number, card_numbers.security_code(network), expiry_date, card_type
+                )
+                (done if inserted else taken).append(user_id)
+            db.executemany("UPDATE users SET has_card = 1 WHERE id = ?", [(user_id,) for user_id in done])
+            if done:
+                stats.increment(cards_count=len(done))
+                etags.bump(*done)
+        issued += done
+        pending = taken
+    return issued
+
+
+def issue(user_id, card_type):
+    """Issue one card; False if the user already has one or does not exist."""
+    return bool(issue_many([user_id], card_type))
+
+
+@click.group('cards')
+def cards_cli():
+    """Virtual card issuance."""
+
+
+@cards_cli.command('issue')
+@click.argument('card_type', type=click.Choice(list(CARD_TYPES)))
+@click.argument('user_ids', type=int, nargs=-1)
+@click.option('--file', 'id_file', type=click.File(), help='Read user ids from a file, one per line.')
+def issue_command(card_type, user_ids, id_file):
+    """Issue CARD_TYPE cards to a batch of users, e.g. for a bulk enrolment."""
+    user_ids = list(user_ids)
+    if id_file:
+        user_ids += [int(line) for line in id_file if line.strip()]
+    if not user_ids:
+        raise click.UsageError("Give user ids as arguments or with --file.")
+    issued = issue_many(user_ids, card_type)
+    click.echo(f"Issued {len(issued)} {card_type} cards; {len(set(user_ids)) - len(issued)} users skipped (already have a card or not found).")
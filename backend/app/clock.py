@@ -0,0 +1,108 @@
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from .config import TIMEZONE
+
+# TEXT timestamps in the database are local time in this format
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Loaded once per process instead of on every request
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+# (epoch second, its TEXT timestamp); formatting happens at most once a second
+_last_text = (None, None)
+
+# Largest unit first, for time_ago
+UNITS = ((30 * 86400, 'month'), (86400, 'day'), (3600, 'hour'), (60, 'minute'))
+
+
+def now():
+    return datetime.now(LOCAL_TZ)
+
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def to_text(ms):
+    """Local TEXT timestamp of an epoch-millisecond value."""
+    global _last_text
+    second = ms // 1000
+    cached_second, text = _last_text
+    if cached_second != second:
+        text = datetime.fromtimestamp(second, LOCAL_TZ).strftime(TIMESTAMP_FORMAT)
+        _last_text = (second, text)
+    return text
+
+
+def now_text():
+    return to_text(now_ms())
+
+
+def stamp():
+    """(TEXT timestamp, epoch ms) of one instant, for rows that store both."""
+    ms = now_ms()
+    return to_text(ms), ms
+
+
+def parse_ms(text, tz=LOCAL_TZ):
+    """
+    Epoch milliseconds of a local TEXT timestamp or date; None if it isn't
+    one. tz=None reads it as the server's own local time instead.
+    """
+    if not text:
+        return None
+    try:
+        local = datetime.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+    if local.tzinfo is None and tz is not None:
+        local = local.replace(tzinfo=tz)
+    return int(local.timestamp() * 1000)
+
+
+def day_bounds_ms(day=None):
+    """Epoch ms of local midnight at the start and end of `day` (default today)."""
+    day = day or now().date()
+    start = datetime(day.year, day.month, day.day, tzinfo=LOCAL_TZ)
+    end = start + timedelta(days=1)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def row_ms(row, column):
+    """A row's `<column>_ms` value, parsed from the TEXT column for rows written before it existed."""
+    ms = row.get(f'{column}_ms')
+    return ms if ms is not None else parse_ms(row.get(column))
+
+
+def time_ago(values, now=None):
+    """
+    '3 days', '1 hour', 'just now'... for a list of epoch-ms values, all
+    measured against the same `now`. None gives ''.
+    """
+    now = now_ms() if now is None else now
+    labels = []
+    for ms in values:
+        if ms is None:
+            labels.append('')
+            continue
+        seconds = (now - ms) // 1000
+        for size, unit in UNITS:
+            if seconds >= size:
+                count = seconds // size
+                labels.append(f"{count} {unit}{'s' if count > 1 else ''}")
+                break
+        else:
+            labels.append('just now')
+    return labels
+
+
+def days_ago(values, now=None):
+    """Whole days between each epoch-ms value and `now`; None stays None."""
+    now = now_ms() if now is None else now
+    return [None if ms is None else (now - ms) // 86_400_000 for ms in values]
+
+
+def format_ms(ms, fmt):
+    """strftime of an epoch-ms value in local time."""
+    return datetime.fromtimestamp(ms / 1000, LOCAL_TZ).strftime(fmt)
@@ -5,6 +5,83 @@ load_dotenv()
 
 # Get the absolute path of the project root
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'instance/database.db')}"
+DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'instance/database.db'))
+DATABASE_URI = f"sqlite:///{DATABASE_PATH}"
 JWT_SECRET = os.environ.get('JWT_SECRET')
 
+# Database connection settings
+DATABASE_BUSY_TIMEOUT_MS = int(os.environ.get('DATABASE_BUSY_TIMEOUT_MS', 5000))
+DATABASE_STATEMENT_CACHE_SIZE = int(os.environ.get('DATABASE_STATEMENT_CACHE_SIZE', 256))
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 8))
+
+# Push notification delivery
+NOTIFICATION_TRANSPORT = os.environ.get('NOTIFICATION_TRANSPORT', 'firebase')  # 'firebase' or 'fake'
+NOTIFICATION_WORKERS = int(os.environ.get('NOTIFICATION_WORKERS', 2))
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 10000))
+NOTIFICATION_MAX_RETRIES = int(os.environ.get('NOTIFICATION_MAX_RETRIES', 3))
+
+# Authenticated user cache
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 30))  # seconds
+AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+
+# Buffered writes to the logs table
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 100))
+LOG_FLUSH_INTERVAL_MS = int(os.environ.get('LOG_FLUSH_INTERVAL_MS', 500))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_OVERFLOW_POLICY = os.environ.get('LOG_OVERFLOW_POLICY', 'drop_oldest')  # 'drop_oldest', 'drop_newest' or 'block'
+
+# Transaction IDs: keep TXN_ID_KEY stable once IDs have been issued
+TXN_ID_KEY = os.environ.get('TXN_ID_KEY')
+TXN_ID_BLOCK_SIZE = int(os.environ.get('TXN_ID_BLOCK_SIZE', 64))
+# Card numbers: keep CARD_NUMBER_KEY stable once cards have been issued (falls back like TXN_ID_KEY)
+CARD_NUMBER_KEY = os.environ.get('CARD_NUMBER_KEY')
+
+# QR scan history kept per user
+QR_SCAN_RETENTION = int(os.environ.get('QR_SCAN_RETENTION', 100))
+
+# Password hashing: raise the cost here and old hashes are upgraded on login
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))  # 0 hashes on the request thread
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))  # seconds to wait for a free slot
+
+# Attempt limits, per process, over a sliding window
+LOGIN_ATTEMPT_WINDOW = float(os.environ.get('LOGIN_ATTEMPT_WINDOW', 300))  # seconds
+LOGIN_ATTEMPTS_PER_PHONE = int(os.environ.get('LOGIN_ATTEMPTS_PER_PHONE', 5))
+LOGIN_ATTEMPTS_PER_IP = int(os.environ.get('LOGIN_ATTEMPTS_PER_IP', 30))
+SIGNUP_ATTEMPTS_PER_IP = int(os.environ.get('SIGNUP_ATTEMPTS_PER_IP', 10))
+
+# Request and SQL timing, served at /admin/metrics. Off installs no hooks at all.
+INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION', '1') == '1'
+INSTRUMENTATION_SLOW_QUERY_MS = float(os.environ.get('INSTRUMENTATION_SLOW_QUERY_MS', 50))
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = int(os.environ.get('INSTRUMENTATION_N_PLUS_ONE_THRESHOLD', 10))  # same statement per request
+
+# Apply pending schema migrations in create_app; with 0 run `flask schema migrate` on deploy instead
+MIGRATE_ON_STARTUP = os.environ.get('MIGRATE_ON_STARTUP', '1') == '1'
+
+# Idempotency-Key support for money-moving endpoints
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 86400))  # seconds a stored response is replayed
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))  # unfinished claims older than this can be retaken
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL', 300))  # seconds between expiry sweeps
+
+# Admin broadcasts to every registered device
+BROADCAST_CHUNK_SIZE = int(os.environ.get('BROADCAST_CHUNK_SIZE', 500))  # FCM's multicast limit
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 4))  # chunks in flight at once
+BROADCAST_LEASE = float(os.environ.get('BROADCAST_LEASE', 120))  # seconds before a stalled broadcast can be resumed elsewhere
+
+# Phone directory: numbers are stored and looked up in E.164
+PHONE_COUNTRY_CODE = os.environ.get('PHONE_COUNTRY_CODE', '92')  # for numbers entered without one
+DIRECTORY_CACHE_SIZE = int(os.environ.get('DIRECTORY_CACHE_SIZE', 50000))
+DIRECTORY_CACHE_TTL = float(os.environ.get('DIRECTORY_CACHE_TTL', 60))  # seconds
+USERS_MATCH_MAX_BATCH = int(os.environ.get('USERS_MATCH_MAX_BATCH', 2000))  # numbers per /api/users/match call
+USERS_MATCH_WINDOW = float(os.environ.get('USERS_MATCH_WINDOW', 3600))  # seconds
+USERS_MATCH_PER_USER = int(os.environ.get('USERS_MATCH_PER_USER', 10))  # calls per window
+USERS_MATCH_PER_IP = int(os.environ.get('USERS_MATCH_PER_IP', 30))
+
+# Ledger reconciliation, see `flask ledger reconcile`
+LEDGER_CHUNK_ROWS = int(os.environ.get('LEDGER_CHUNK_ROWS', 100000))  # transaction ids aggregated per query
+LEDGER_SNAPSHOT_RETENTION = int(os.environ.get('LEDGER_SNAPSHOT_RETENTION', 30))  # balance snapshots kept
+
+# Local time zone of the TEXT timestamps in the database, see app/clock.py
+TIMEZONE = os.environ.get('TIMEZONE', 'Asia/Karachi')
@@ -0,0 +1,91 @@
+import sqlite3
+from .database import db
+from .transfers import AccountNotFound
+from . import stats, clock, etags, idempotency
+
+
+class RedemptionError(Exception):
+    pass
+
+
+class CouponNotFound(RedemptionError):
+    pass
+
+
+class CouponExpired(RedemptionError):
+    pass
+
+
+class CouponExhausted(RedemptionError):
+    pass
+
+
+class AlreadyRedeemed(RedemptionError):
+    pass
+
+
+def redeem(user_id, coupon_code, timestamp, claim=None, timestamp_ms=None):
+    """
+    Redeem a coupon in a single BEGIN IMMEDIATE transaction.
+
+    The redemption row is inserted first, straight from the coupon row and
+    only while the coupon is unexpired and under its usage cap. The
+    UNIQUE(coupon_id, user_id) constraint rejects a second redemption
+    without a separate lookup. After that the coupon's use count and the
+    user's balance are bumped and the ledger row is written. Any failure
+    rolls back all of it.
+
+    `timestamp` is the current local time as 'YYYY-MM-DD HH:MM:SS', the
+    same format as coupons.expires_at, and `timestamp_ms` its epoch-ms
+    value from the same clock.stamp() (parsed from the text when missing).
+    Returns the coupon id, amount and the new balance, recorded on the
+    idempotency `claim` if there is one.
+    """
+    if timestamp_ms is None:
+        timestamp_ms = clock.parse_ms(timestamp)
+    with db.transaction(immediate=True):
+        try:
+            redeemed = db.execute(
+                "INSERT INTO coupon_redemptions (coupon_id, user_id, amount, redeemed_at) "
+                "SELECT id, ?, amount, ? FROM coupons WHERE coupon_code = ? "
+                "AND (expires_at IS NULL OR expires_at > ?) "
+                "AND (max_uses IS NULL OR uses < max_uses) "
+                "RETURNING coupon_id, amount",
+                user_id, timestamp, coupon_code, timestamp
+            )
+        except sqlite3.IntegrityError:
+            raise AlreadyRedeemed(coupon_code)
+        if not redeemed:
+            _raise_unavailable(coupon_code, timestamp)
+        coupon_id, amount = redeemed[0]['coupon_id'], float(redeemed[0]['amount'])
+
+        db.execute("UPDATE coupons SET uses = uses + 1 WHERE id = ?", coupon_id)
+        balance = db.execute("UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance", amount, user_id)
+        if not balance:
+            raise AccountNotFound("User not found")
+
+        # sender_id = coupon_id for redemptions
+        db.execute(
+            "INSERT INTO transactions (transaction_type, sender_id, receiver_id, amount, status, note, timestamp, timestamp_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            'redeemed', coupon_id, user_id, amount, 'completed', coupon_code, timestamp, timestamp_ms
+        )
+        stats.increment(balance_total=amount, transactions_count=1, transactions_amount_total=amount)
+        etags.bump(user_id)
+
+        result = {
+            "coupon_id": coupon_id,
+            "amount": amount,
+            "new_balance": float(balance[0]['balance']),
+        }
+        idempotency.record_effect(claim, result)
+    return result
+
+
+def _raise_unavailable(coupon_code, timestamp):
+    # Slow path: only runs when the insert found no usable coupon
+    coupon = db.execute("SELECT expires_at, max_uses, uses FROM coupons WHERE coupon_code = ?", coupon_code)
+    if not coupon:
+        raise CouponNotFound(coupon_code)
+    if coupon[0]['expires_at'] is not None and coupon[0]['expires_at'] <= timestamp:
+        raise CouponExpired(coupon_code)
+    raise CouponExhausted(coupon_code)
@@ -1,16 +1,188 @@
 import os
-from cs50 import SQL
-from .config import DATABASE_URI
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from .config import (
+    DATABASE_PATH,
+    DATABASE_BUSY_TIMEOUT_MS,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DATABASE_POOL_SIZE,
+)
+
+
+class Database:
+    """
+    Thread-safe SQLite access layer.
+
+    Every thread gets its own connection, taken from a small pool of idle
+    connections and handed back by release() at the end of a request.
+    Connections run in WAL mode with a busy timeout, and sqlite3's statement
+    cache keeps compiled statements around between calls.
+
+    execute() keeps the behaviour of the old cs50.SQL handle: SELECTs return
+    a list of rows, INSERTs return the new rowid and UPDATE/DELETE return the
+    number of affected rows.
+
+    Set `observer` to a callable(sql, seconds) to time every statement;
+    when it is None (the default) statements run untimed.
+    """
+
+    ROW_FACTORIES = ('dict', 'row', 'tuple')
+
+    def __init__(self, path, busy_timeout_ms=5000, statement_cache_size=256, row_factory='dict', pool_size=8):
+        if row_factory not in self.ROW_FACTORIES:
+            raise ValueError(f"Unknown row factory: {row_factory}")
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.statement_cache_size = statement_cache_size
+        self.row_factory = row_factory
+        self.pool_size = pool_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self.observer = None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,  # autocommit, explicit BEGIN/COMMIT only
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def _check_pid(self):
+        # Connections must never be shared across a fork; start clean in the child
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._idle = []
+                    self._local = threading.local()
+                    self._pid = os.getpid()
+
+    def connection(self):
+        """Return the connection bound to the current thread."""
+        self._check_pid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Hand the current thread's connection back to the pool."""
+        self._check_pid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self):
+        """Close pooled connections and the current thread's connection."""
+        self.release()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def _observed(self, sql, run, *args):
+        start = time.perf_counter()
+        try:
+            return run(*args)
+        finally:
+            self.observer(sql, time.perf_counter() - start)
+
+    def query(self, sql, *args, row_factory=None):
+        """Run a statement and return its rows using the given row factory."""
+        if self.observer is not None:
+            return self._observed(sql, self._query, sql, args, row_factory)
+        return self._query(sql, args, row_factory)
+
+    def _query(self, sql, args, row_factory):
+        cursor = self.connection().execute(sql, args)
+        return self._fetch(cursor, row_factory or self.row_factory)
+
+    def execute(self, sql, *args):
+        if self.observer is not None:
+            return self._observed(sql, self._execute, sql, args)
+        return self._execute(sql, args)
+
+    def _execute(self, sql, args):
+        cursor = self.connection().execute(sql, args)
+        if cursor.description is not None:
+            return self._fetch(cursor, self.row_factory)
+
+        keyword = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if keyword in ('INSERT', 'REPLACE'):
+            return cursor.lastrowid
+        if keyword in ('UPDATE', 'DELETE'):
+            return cursor.rowcount
+        return True
+
+    def executemany(self, sql, rows):
+        """Run one statement for every parameter tuple; returns affected rows."""
+        if self.observer is not None:
+            return self._observed(sql, self._executemany, sql, rows)
+        return self._executemany(sql, rows)
+
+    def _executemany(self, sql, rows):
+        return self.connection().executemany(sql, rows).rowcount
+
+    def _fetch(self, cursor, row_factory):
+        rows = cursor.fetchall()
+        if row_factory == 'tuple':
+            return rows
+        if row_factory == 'row':
+            return [sqlite3.Row(cursor, row) for row in rows]
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Run the enclosed statements in a single transaction on this thread's
+        connection. Nested calls join the outer transaction.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield self
+            return
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield self
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            conn.commit()
+
 
 # Ensure the instance directory exists
-db_path = DATABASE_URI.replace('sqlite:///', '')
-db_dir = os.path.dirname(db_path)
+db_dir = os.path.dirname(DATABASE_PATH)
 if not os.path.exists(db_dir):
     os.makedirs(db_dir)
 
-# The CS50 library requires the file to exist before connecting.
-# Create an empty file if it doesn't exist.
-if not os.path.exists(db_path):
-    open(db_path, 'a').close()
-
-db = SQL(DATABASE_URI)
+db = Database(
+    DATABASE_PATH,
+    busy_timeout_ms=DATABASE_BUSY_TIMEOUT_MS,
+    statement_cache_size=DATABASE_STATEMENT_CACHE_SIZE,
+    pool_size=DATABASE_POOL_SIZE,
+)
@@ -0,0 +1,195 @@
+import hashlib
+from .database import db
+from .cache import TTLCache
+from .config import PHONE_COUNTRY_CODE, DIRECTORY_CACHE_SIZE, DIRECTORY_CACHE_TTL
+
+# FlexPay IBANs end in the account's 11-digit local phone number
+IBAN_PREFIX = 'PK04FLXP'
+# Phones per IN (...) query in resolve_many
+RESOLVE_BATCH_SIZE = 500
+
+# Directory entries keyed by E.164 number; only hits are cached, so a new
+# signup is visible straight away
+_cache = TTLCache(maxsize=DIRECTORY_CACHE_SIZE, ttl=DIRECTORY_CACHE_TTL)
+
+
+def normalize_phone(raw):
+    """
+    Canonical E.164 form of a phone number or FlexPay IBAN, e.g.
+    '0300-1234567', '923001234567' and '+92 300 1234567' all become
+    '+923001234567'. Numbers without a country code get PHONE_COUNTRY_CODE.
+    Returns None when the input is not a phone number.
+    """
+    if raw is None:
+        return None
+    number = str(raw).strip().upper()
+    if number.startswith(IBAN_PREFIX):
+        number = number[-11:]
+    for separator in ' -().':
+        number = number.replace(separator, '')
+
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0'):
+        digits = PHONE_COUNTRY_CODE + number[1:]
+    elif len(number) == 10:
+        digits = PHONE_COUNTRY_CODE + number
+    else:
+        digits = number
+
+    if not digits.isdigit() or not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+
+def hash_phone(phone):
+    """Hex SHA-256 of the E.164 number; contact sync may upload these instead of numbers."""
+    key = normalize_phone(phone)
+    return hashlib.sha256(key.encode()).hexdigest() if key else None
+
+
+def _entry(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'phone_number': row['phone_number'],
+        'phone_e164': row['phone_e164'],
+        'device_token': row['device_token'],
+    }
+
+
+def resolve(phone, fresh=False):
+    """
+    The user registered under `phone` in any format, or None. Invalidation
+    only reaches this process's cache, so callers about to move money pass
+    `fresh=True` to read the database and refresh the entry.
+    """
+    key = normalize_phone(phone)
+    if key is None:
+        return None
+    entry = None if fresh else _cache.get(key)
+    if entry is None:
+        rows = db.execute(
+            "SELECT id, name, phone_number, phone_e164, device_token FROM users WHERE phone_e164 = ? ORDER BY id LIMIT 1",
+            key
+        )
+        if not rows:
+            return None
+        entry = _entry(rows[0])
+        _cache.set(key, entry)
+    return dict(entry)
+
+
+def _keep_oldest(found, key, row):
+    # The oldest account wins if one number was registered twice; picked
+    # here rather than with ORDER BY, which would sort every batch
+    if key not in found or row['id'] < found[key]['id']:
+        found[key] = _entry(row)
+
+
+def resolve_many(phones):
+    """
+    Resolve a batch of phone numbers with one query per RESOLVE_BATCH_SIZE
+    cache misses. Returns {phone as given: entry} for the numbers that
+    belong to a user; unknown and malformed numbers are left out.
+    """
+    keys = {}
+    for phone in phones:
+        key = normalize_phone(phone)
+        if key is not None:
+            keys.setdefault(key, []).append(phone)
+
+    found = {}
+    missing = []
+    for key in keys:
+        entry = _cache.get(key)
+        if entry is None:
+            missing.append(key)
+        else:
+            found[key] = entry
+
+    for start in range(0, len(missing), RESOLVE_BATCH_SIZE):
+        batch = missing[start:start + RESOLVE_BATCH_SIZE]
+        placeholders = ', '.join('?' * len(batch))
+        for row in db.execute(
+            f"SELECT id, name, phone_number, device_token, phone_e164 FROM users "
+            f"WHERE phone_e164 IN ({placeholders})",
+            *batch
+        ):
+            _keep_oldest(found, row['phone_e164'], row)
+        for key in batch:
+            if key in found:
+                _cache.set(key, found[key])
+
+    return {phone: dict(found[key]) for key, given in keys.items() if key in found for phone in given}
+
+
+def match(phones=(), hashes=()):
+    """
+    Yield (kind, value as given, entry) for every phone number or phone hash
+    that belongs to a user, one RESOLVE_BATCH_SIZE batch at a time, so a
+    whole address book costs a handful of queries. `kind` is 'phone' or 'hash'.
+    """
+    for start in range(0, len(phones), RESOLVE_BATCH_SIZE):
+        for phone, entry in resolve_many(phones[start:start + RESOLVE_BATCH_SIZE]).items():
+            yield 'phone', phone, entry
+
+    for start in range(0, len(hashes), RESOLVE_BATCH_SIZE):
+        batch = hashes[start:start + RESOLVE_BATCH_SIZE]
+        keys = {str(value).strip().lower() for value in batch}
+        placeholders = ', '.join('?' * len(keys))
+        found = {}
+        for row in db.execute(
+            f"SELECT id, name, phone_number, phone_e164, device_token, phone_hash FROM users "
+            f"WHERE phone_hash IN ({placeholders})",
+            *keys
+        ):
+            _keep_oldest(found, row['phone_hash'], row)
+        for value in batch:
+            entry = found.get(str(value).strip().lower())
+            if entry is not None:
+                yield 'hash', value, dict(entry)
+
+
+def invalidate(*phones):
+    """Drop cached entries; call after any write to a user's name, phone or device token."""
+    for phone in phones:
+        key = normalize_phone(phone)
+        if key is not None:
+            _cache.delete(key)
+
+
+def invalidate_users(user_ids):
+    """invalidate() for writes that only know the user ids, e.g. dead token pruning."""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), RESOLVE_BATCH_SIZE):
+        batch = user_ids[start:start + RESOLVE_BATCH_SIZE]
+        placeholders = ', '.join('?' * len(batch))
+        rows = db.query(f"SELECT phone_e164 FROM users WHERE id IN ({placeholders})", *batch, row_factory='tuple')
+        for (key,) in rows:
+            if key is not None:
+                _cache.delete(key)
+
+
+def backfill(db):
+    """Migration step: fill users.phone_e164 from phone_number."""
+    rows = db.query("SELECT id, phone_number FROM users WHERE phone_e164 IS NULL", row_factory='tuple')
+    db.executemany(
+        "UPDATE users SET phone_e164 = ? WHERE id = ?",
+        [(normalize_phone(phone), user_id) for user_id, phone in rows]
+    )
+
+
+def backfill_hashes(db):
+    """Migration step: fill users.phone_hash from phone_e164."""
+    rows = db.query("SELECT id, phone_e164 FROM users WHERE phone_hash IS NULL AND phone_e164 IS NOT NULL", row_factory='tuple')
+    db.executemany(
+        "UPDATE users SET phone_hash = ? WHERE id = ?",
+        [(hash_phone(phone), user_id) for user_id, phone in rows]
+    )
+
+
+def cache_stats():
+    return _cache.stats()
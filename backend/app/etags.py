@@ -0,0 +1,63 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from .database import db
+
+
+def bump(*user_ids):
+    """
+    Advance the data version of each user. Call inside the transaction of
+    any write that changes what their balance, profile, beneficiaries or
+    history endpoints return, so the new version commits with the data.
+    """
+    db.executemany(
+        "INSERT INTO user_versions (user_id, version) VALUES (?, 1) "
+        "ON CONFLICT (user_id) DO UPDATE SET version = version + 1",
+        [(user_id,) for user_id in set(user_ids)]
+    )
+
+
+def bump_related(user_id):
+    """Bump the users whose beneficiary list or history shows this user's name or number."""
+    rows = db.query(
+        "SELECT user_id FROM beneficiaries WHERE beneficiary_id = ? "
+        "UNION SELECT receiver_id FROM transactions WHERE sender_id = ? AND transaction_type != 'redeemed' "
+        "UNION SELECT sender_id FROM transactions WHERE receiver_id = ? AND transaction_type != 'redeemed'",
+        user_id, user_id, user_id, row_factory='tuple'
+    )
+    bump(*(row[0] for row in rows if row[0] != user_id))
+
+
+def current(user_id):
+    row = db.query("SELECT version FROM user_versions WHERE user_id = ?", user_id, row_factory='tuple')
+    return row[0][0] if row else 0
+
+
+def conditional(f):
+    """
+    ETag support for a per-user GET endpoint.
+
+    The ETag is the user's data version, read before the handler runs, so a
+    write that lands while the response is being built only makes the next
+    poll miss. It also carries a hash of the path and query string: the
+    version is shared by all of a user's endpoints, and a tag taken from one
+    of them (or from another page of history) must not validate another.
+    A request whose If-None-Match still matches gets 304 without
+    the handler's queries or serialization.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        user_id = current_user['id']
+        resource = hashlib.blake2b(request.full_path.encode(), digest_size=6).hexdigest()
+        etag = f"{user_id}-{current(user_id)}-{resource}"
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(current_user, *args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Clients may keep the body but must check with us before reusing it
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated
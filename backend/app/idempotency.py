@@ -0,0 +1,202 @@
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+from flask import request, jsonify, make_response, g
+from .database import db
+from .cache import TTLCache
+from .config import IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TIMEOUT, IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_PURGE_INTERVAL
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+PURGE_BATCH = 1000
+
+# Completed responses, keyed by (user_id, key), so most replays skip the database
+responses = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+
+_purge_lock = threading.Lock()
+_last_purge = 0.0
+
+
+def fingerprint(endpoint, body):
+    return hashlib.sha256(endpoint.encode() + b'\0' + body).hexdigest()
+
+
+def purge_expired(now=None):
+    """Delete expired keys in small batches; returns how many were removed."""
+    now = time.time() if now is None else now
+    removed = 0
+    while True:
+        deleted = db.execute(
+            "DELETE FROM idempotency_keys WHERE id IN "
+            "(SELECT id FROM idempotency_keys WHERE expires_at < ? LIMIT ?)",
+            now, PURGE_BATCH
+        )
+        removed += deleted
+        if deleted < PURGE_BATCH:
+            return removed
+
+
+def _maybe_purge(now):
+    global _last_purge
+    if now - _last_purge < IDEMPOTENCY_PURGE_INTERVAL or not _purge_lock.acquire(blocking=False):
+        return
+    try:
+        _last_purge = now
+        purge_expired(now)
+    finally:
+        _purge_lock.release()
+
+
+def current_claim():
+    """(user_id, key) of the request being handled under an Idempotency-Key, else None."""
+    return g.get('idempotency_claim')
+
+
+def record_effect(claim, result):
+    """
+    Note on the claim that the request's money movement happened. Call
+    inside the same transaction as the movement, so a worker that dies
+    before storing its response can't leave a claim that a retry would
+    take over and run a second time.
+    """
+    if claim is None:
+        return
+    db.execute(
+        "UPDATE idempotency_keys SET effect = ? WHERE user_id = ? AND idempotency_key = ?",
+        json.dumps(result), *claim
+    )
+
+
+def _recovered_body(effect):
+    # The handler died after committing; rebuild what we can from its result
+    return json.dumps({"message": "This request was already completed", **json.loads(effect)})
+
+
+def claim(user_id, key, request_hash, now):
+    """
+    Reserve `key` for this request. Returns (True, None) when the caller
+    should run the request, or (False, row) with the stored row otherwise.
+    Expired keys and claims abandoned for longer than the lock timeout are
+    taken over, unless the abandoned request already committed its effect;
+    that claim is completed from the effect instead of running again.
+    """
+    with db.transaction(immediate=True):
+        rows = db.execute(
+            "SELECT id, request_hash, status_code, response_body, created_at, expires_at, effect "
+            "FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?",
+            user_id, key
+        )
+        if rows:
+            row = rows[0]
+            abandoned = row['status_code'] is None and row['created_at'] < now - IDEMPOTENCY_LOCK_TIMEOUT
+            if row['expires_at'] >= now and not abandoned:
+                return False, row
+            if row['expires_at'] >= now and row['effect'] is not None:
+                row['status_code'], row['response_body'] = 200, _recovered_body(row['effect'])
+                db.execute(
+                    "UPDATE idempotency_keys SET status_code = ?, response_body = ? WHERE id = ?",
+                    row['status_code'], row['response_body'], row['id']
+                )
+                return False, row
+            db.execute("DELETE FROM idempotency_keys WHERE id = ?", row['id'])
+        db.execute(
+            "INSERT INTO idempotency_keys (user_id, idempotency_key, endpoint, request_hash, created_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            user_id, key, request.endpoint, request_hash, now, now + IDEMPOTENCY_TTL
+        )
+    return True, None
+
+
+def _release(user_id, key, request_hash):
+    """
+    Drop the claim of a request that failed, so the client can retry it.
+    A claim with an effect is kept: the money movement committed before
+    the failure, and a retry must not run it again. It is completed from
+    the effect instead, and the recovered body is returned.
+    """
+    with db.transaction(immediate=True):
+        if db.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ? AND effect IS NULL", user_id, key):
+            return None
+        rows = db.execute("SELECT effect FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?", user_id, key)
+        if not rows:
+            return None
+        body = _recovered_body(rows[0]['effect'])
+        db.execute(
+            "UPDATE idempotency_keys SET status_code = 200, response_body = ? WHERE user_id = ? AND idempotency_key = ?",
+            body, user_id, key
+        )
+    responses.set((user_id, key), (request_hash, 200, body))
+    return body
+
+
+def _replay(status_code, body):
+    response = make_response(body, status_code)
+    response.mimetype = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(f):
+    """
+    Honour an Idempotency-Key header on an authenticated endpoint.
+
+    The first request with a key runs normally and its response is stored
+    for IDEMPOTENCY_TTL seconds. Retries with the same key and body get the
+    stored response back without running the handler again; the same key
+    with a different body is rejected with 422, and a retry that arrives
+    while the first request is still running gets 409. Server errors are
+    not stored, so the client can retry them with the same key, unless
+    the money already moved: then the claim is completed from its effect
+    and the request answers, and replays, as a success.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return f(current_user, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"error": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"}), 400
+
+        user_id = current_user['id']
+        request_hash = fingerprint(request.endpoint, request.get_data())
+        cached = responses.get((user_id, key))
+        if cached is not None and cached[0] == request_hash:
+            return _replay(cached[1], cached[2])
+
+        now = time.time()
+        _maybe_purge(now)
+        owner, row = claim(user_id, key, request_hash, now)
+        if not owner:
+            if row['request_hash'] != request_hash:
+                return jsonify({"error": f"{HEADER} was already used for a different request"}), 422
+            if row['status_code'] is None:
+                return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            responses.set((user_id, key), (request_hash, row['status_code'], row['response_body']))
+            return _replay(row['status_code'], row['response_body'])
+
+        g.idempotency_claim = (user_id, key)
+        try:
+            response = make_response(f(current_user, *args, **kwargs))
+        except BaseException:
+            _release(user_id, key, request_hash)
+            raise
+
+        if response.status_code >= 500:
+            recovered = _release(user_id, key, request_hash)
+            if recovered is None:
+                return response
+            # The money moved before the handler failed; report that, not the error
+            response = make_response(recovered, 200)
+            response.mimetype = 'application/json'
+            return response
+
+        body = response.get_data(as_text=True)
+        db.execute(
+            "UPDATE idempotency_keys SET status_code = ?, response_body = ? WHERE user_id = ? AND idempotency_key = ?",
+            response.status_code, body, user_id, key
+        )
+        responses.set((user_id, key), (request_hash, response.status_code, body))
+        return response
+    return decorated
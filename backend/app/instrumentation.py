@@ -0,0 +1,167 @@
+import re
+import threading
+import time
+from collections import deque
+from flask import request
+from .database import db
+from .config import (
+    INSTRUMENTATION_ENABLED,
+    INSTRUMENTATION_SLOW_QUERY_MS,
+    INSTRUMENTATION_N_PLUS_ONE_THRESHOLD,
+)
+
+# Requests kept per endpoint for the latency percentiles
+LATENCY_SAMPLES = 1000
+SLOW_QUERIES_KEPT = 100
+BACKGROUND = '<background>'
+
+
+def normalize_sql(sql):
+    """Collapse whitespace so the same statement always groups together."""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Instrumentation:
+    """
+    Aggregates request wall time per endpoint and the count and duration
+    of every statement run through `db`.
+
+    Within one request, a statement that runs `n_plus_one_threshold` times
+    or more is recorded as an N+1 pattern. Any statement slower than
+    `slow_query_ms` goes into a bounded list of slow queries.
+    """
+
+    def __init__(self, slow_query_ms=50, n_plus_one_threshold=10):
+        self.slow_query_ms = slow_query_ms
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.endpoints = {}
+            self.statements = {}
+            self.slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+            self.n_plus_one = {}
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        db.observer = self.observe
+
+    def before_request(self):
+        self._local.start = time.perf_counter()
+        self._local.statements = {}
+
+    def observe(self, sql, seconds):
+        sql = normalize_sql(sql)
+        ms = seconds * 1000
+        statements = getattr(self._local, 'statements', None)
+        if statements is not None:
+            count, total = statements.get(sql, (0, 0.0))
+            statements[sql] = (count + 1, total + ms)
+        endpoint = request.endpoint if statements is not None else BACKGROUND
+        with self._lock:
+            entry = self.statements.get(sql)
+            if entry is None:
+                entry = self.statements[sql] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            if ms >= self.slow_query_ms:
+                self.slow_queries.append({'sql': sql, 'ms': round(ms, 3), 'endpoint': endpoint, 'at': time.time()})
+
+    def after_request(self, response):
+        start = getattr(self._local, 'start', None)
+        statements = getattr(self._local, 'statements', None)
+        self._local.start = self._local.statements = None
+        if start is None:
+            return response
+
+        ms = (time.perf_counter() - start) * 1000
+        endpoint = request.endpoint or request.path
+        sql_count = sum(count for count, _ in statements.values())
+        sql_ms = sum(total for _, total in statements.values())
+        with self._lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = {
+                    'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'sql_count': 0, 'sql_ms': 0.0, 'samples': deque(maxlen=LATENCY_SAMPLES),
+                }
+            entry['count'] += 1
+            entry['errors'] += response.status_code >= 500
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['sql_count'] += sql_count
+            entry['sql_ms'] += sql_ms
+            entry['samples'].append(ms)
+
+            for sql, (count, _) in statements.items():
+                if count >= self.n_plus_one_threshold:
+                    key = (endpoint, sql)
+                    pattern = self.n_plus_one.get(key)
+                    if pattern is None:
+                        pattern = self.n_plus_one[key] = {'endpoint': endpoint, 'sql': sql, 'requests': 0, 'max_repeats': 0}
+                    pattern['requests'] += 1
+                    pattern['max_repeats'] = max(pattern['max_repeats'], count)
+        return response
+
+    def snapshot(self, top=50):
+        with self._lock:
+            endpoints = {}
+            for name, entry in self.endpoints.items():
+                ordered = sorted(entry['samples'])
+                endpoints[name] = {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'mean_ms': round(entry['total_ms'] / entry['count'], 3),
+                    'p50_ms': round(_percentile(ordered, 0.50), 3),
+                    'p95_ms': round(_percentile(ordered, 0.95), 3),
+                    'p99_ms': round(_percentile(ordered, 0.99), 3),
+                    'max_ms': round(entry['max_ms'], 3),
+                    'sql_per_request': round(entry['sql_count'] / entry['count'], 2),
+                    'sql_ms_per_request': round(entry['sql_ms'] / entry['count'], 3),
+                }
+            statements = sorted(
+                ({'sql': sql, 'count': entry['count'], 'total_ms': round(entry['total_ms'], 3),
+                  'mean_ms': round(entry['total_ms'] / entry['count'], 3), 'max_ms': round(entry['max_ms'], 3)}
+                 for sql, entry in self.statements.items()),
+                key=lambda entry: entry['total_ms'], reverse=True,
+            )[:top]
+            return {
+                'enabled': True,
+                'since': self.started_at,
+                'slow_query_ms': self.slow_query_ms,
+                'n_plus_one_threshold': self.n_plus_one_threshold,
+                'endpoints': endpoints,
+                'statements': statements,
+                'slow_queries': list(self.slow_queries),
+                'n_plus_one': sorted(self.n_plus_one.values(), key=lambda entry: entry['max_repeats'], reverse=True),
+            }
+
+
+instrumentation = Instrumentation(
+    slow_query_ms=INSTRUMENTATION_SLOW_QUERY_MS,
+    n_plus_one_threshold=INSTRUMENTATION_N_PLUS_ONE_THRESHOLD,
+)
+
+
+def init_app(app):
+    """Attach the hooks; with INSTRUMENTATION off nothing is installed."""
+    if INSTRUMENTATION_ENABLED:
+        instrumentation.init_app(app)
+
+
+def metrics():
+    if not INSTRUMENTATION_ENABLED:
+        return {'enabled': False}
+    return instrumentation.snapshot()
@@ -0,0 +1,178 @@
+from datetime import datetime, timezone
+import click
+from .database import db
+from .config import LEDGER_CHUNK_ROWS, LEDGER_SNAPSHOT_RETENTION
+
+# Smallest difference between users.balance and the ledger that counts as drift
+TOLERANCE = 0.005
+
+# Net balance change per user for one rowid range of the ledger. A transfer
+# writes a 'sent' and a 'received' row; 'transfer' is the older single-row
+# form and 'redeemed' has the coupon id as sender.
+DELTAS_SQL = (
+    "SELECT user_id, SUM(delta) FROM ("
+    "  SELECT sender_id AS user_id, -amount AS delta FROM transactions"
+    "   WHERE id > ? AND id <= ? AND transaction_type IN ('sent', 'transfer')"
+    "  UNION ALL"
+    "  SELECT receiver_id AS user_id, amount AS delta FROM transactions"
+    "   WHERE id > ? AND id <= ? AND transaction_type IN ('received', 'redeemed', 'transfer')"
+    ") GROUP BY user_id"
+)
+
+# What a user's ledger rows added to everyone else's balance; coupons are
+# the counterparty of 'redeemed' rows, so those have none
+COUNTERPARTY_DELTAS_SQL = (
+    "SELECT user_id, SUM(delta) FROM ("
+    "  SELECT sender_id AS user_id, -amount AS delta FROM transactions"
+    "   WHERE receiver_id = ? AND transaction_type IN ('sent', 'transfer')"
+    "  UNION ALL"
+    "  SELECT receiver_id AS user_id, amount AS delta FROM transactions"
+    "   WHERE sender_id = ? AND transaction_type IN ('received', 'transfer')"
+    ") WHERE user_id != ? GROUP BY user_id"
+)
+
+
+def latest_snapshot():
+    rows = db.execute("SELECT * FROM balance_snapshots ORDER BY id DESC LIMIT 1")
+    return rows[0] if rows else None
+
+
+def _snapshot_balances(snapshot_id):
+    return dict(db.query(
+        "SELECT user_id, balance FROM balance_snapshot_entries WHERE snapshot_id = ?",
+        snapshot_id, row_factory='tuple'
+    ))
+
+
+def _apply(balances, start, end):
+    """Add the ledger rows with start < id <= end to `balances`, LEDGER_CHUNK_ROWS ids at a time."""
+    for low in range(start, end, LEDGER_CHUNK_ROWS):
+        high = min(low + LEDGER_CHUNK_ROWS, end)
+        for user_id, delta in db.query(DELTAS_SQL, low, high, low, high, row_factory='tuple'):
+            balances[user_id] = balances.get(user_id, 0.0) + delta
+
+
+def record_removal(user_id, reason):
+    """
+    Call in the transaction that deletes `user_id`'s ledger rows, before
+    deleting them: keeps what those rows added to other users' balances as
+    ledger_adjustments, so replaying the remaining ledger still adds up.
+    """
+    deltas = db.query(COUNTERPARTY_DELTAS_SQL, user_id, user_id, user_id, row_factory='tuple')
+    created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    db.executemany(
+        "INSERT INTO ledger_adjustments (user_id, amount, reason, created_at) VALUES (?, ?, ?, ?)",
+        [(counterparty, delta, reason, created_at) for counterparty, delta in deltas if delta]
+    )
+
+
+def _apply_adjustments(balances, start, end):
+    for user_id, amount in db.query(
+        "SELECT user_id, SUM(amount) FROM ledger_adjustments WHERE id > ? AND id <= ? GROUP BY user_id",
+        start, end, row_factory='tuple'
+    ):
+        balances[user_id] = balances.get(user_id, 0.0) + amount
+
+
+def compute(full=False):
+    """
+    Ledger balance of every user, continued from the latest snapshot.
+
+    Only rows after the snapshot's checkpoint are read. If rows at or
+    before it were deleted since (account deletion removes a user's
+    transfers) the snapshot no longer adds up and the whole ledger is
+    replayed instead. Either way the ledger_adjustments those deletions
+    left behind are added on top. Runs in one read transaction, so the
+    balances and the ledger are compared as of the same moment.
+    """
+    with db.transaction():
+        end, rows = db.query("SELECT COALESCE(MAX(id), 0), COUNT(*) FROM transactions", row_factory='tuple')[0]
+        adjustments_end = db.query("SELECT COALESCE(MAX(id), 0) FROM ledger_adjustments", row_factory='tuple')[0][0]
+        snapshot = None if full else latest_snapshot()
+        if snapshot is not None:
+            kept = db.query("SELECT COUNT(*) FROM transactions WHERE id <= ?", snapshot['ledger_rowid'], row_factory='tuple')[0][0]
+            if kept != snapshot['ledger_rows']:
+                snapshot = None
+
+        if snapshot is None:
+            start, adjustments_start, balances = 0, 0, {}
+        else:
+            start, adjustments_start = snapshot['ledger_rowid'], snapshot['adjustment_rowid']
+            balances = _snapshot_balances(snapshot['id'])
+        _apply(balances, start, end)
+        _apply_adjustments(balances, adjustments_start, adjustments_end)
+
+        stored = dict(db.query("SELECT id, balance FROM users", row_factory='tuple'))
+
+    # Ledger rows of users that no longer exist are left out
+    ledger = {user_id: balances.get(user_id, 0.0) for user_id in stored}
+    drift = {
+        user_id: (stored[user_id], round(ledger[user_id], 2))
+        for user_id in stored
+        if abs(stored[user_id] - ledger[user_id]) > TOLERANCE
+    }
+    return {
+        'ledger_rowid': end,
+        'ledger_rows': rows,
+        'adjustment_rowid': adjustments_end,
+        'rows_scanned': rows if snapshot is None else rows - snapshot['ledger_rows'],
+        'incremental': snapshot is not None,
+        'balances': ledger,
+        'drift': drift,
+    }
+
+
+def record_snapshot(result):
+    """Store the ledger balances of a compute() run and drop all but the newest LEDGER_SNAPSHOT_RETENTION."""
+    with db.transaction(immediate=True):
+        snapshot_id = db.execute(
+            "INSERT INTO balance_snapshots (ledger_rowid, ledger_rows, adjustment_rowid, users_count, balance_total, drift_count, taken_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            result['ledger_rowid'], result['ledger_rows'], result['adjustment_rowid'], len(result['balances']),
+            sum(result['balances'].values()), len(result['drift']),
+            datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        )
+        db.executemany(
+            "INSERT INTO balance_snapshot_entries (snapshot_id, user_id, balance) VALUES (?, ?, ?)",
+            [(snapshot_id, user_id, balance) for user_id, balance in result['balances'].items()]
+        )
+        expired = db.query(
+            "SELECT id FROM balance_snapshots ORDER BY id DESC LIMIT -1 OFFSET ?",
+            LEDGER_SNAPSHOT_RETENTION, row_factory='tuple'
+        )
+        db.executemany("DELETE FROM balance_snapshot_entries WHERE snapshot_id = ?", expired)
+        db.executemany("DELETE FROM balance_snapshots WHERE id = ?", expired)
+    return snapshot_id
+
+
+def reconcile(full=False, snapshot=True):
+    """
+    Compare users.balance with the ledger. Returns the compute() result,
+    whose 'drift' maps user ids to (stored, ledger) balances; with
+    snapshot=True the balances are also recorded as the next checkpoint.
+    """
+    result = compute(full=full)
+    if snapshot:
+        result['snapshot_id'] = record_snapshot(result)
+    return result
+
+
+@click.group('ledger')
+def ledger_cli():
+    """Balance snapshots and reconciliation."""
+
+
+@ledger_cli.command('reconcile')
+@click.option('--full', is_flag=True, help='Replay the whole ledger instead of continuing from the last snapshot.')
+@click.option('--no-snapshot', is_flag=True, help='Check only; do not record a snapshot.')
+def reconcile_command(full, no_snapshot):
+    """Check every user's balance against the transactions ledger."""
+    result = reconcile(full=full, snapshot=not no_snapshot)
+    mode = 'from the last snapshot' if result['incremental'] else 'from the start'
+    click.echo(f"Scanned {result['rows_scanned']} ledger rows {mode} up to id {result['ledger_rowid']}.")
+    if not result['drift']:
+        click.echo(f"All {len(result['balances'])} balances match the ledger.")
+        return
+    for user_id, (stored, ledger) in sorted(result['drift'].items()):
+        click.echo(f"user {user_id}: balance {stored}, ledger {ledger}")
+    raise SystemExit(1)
@@ -1,16 +1,160 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
 from .database import db
-from flask import request
+from .config import LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL_MS, LOG_QUEUE_SIZE, LOG_OVERFLOW_POLICY
+from flask import request, has_request_context
 
-def log_event(level, message, user_id=None, details=None):
+INSERT_LOG = "INSERT INTO logs (timestamp, level, message, user_id, ip_address, details) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+class LogBuffer:
     """
-    Logs an event to the database.
+    Bounded in-memory queue of log rows, written by a background thread.
+
+    The flusher writes everything queued with one executemany in a single
+    transaction whenever `batch_size` rows are waiting or `flush_interval`
+    seconds have passed; if a row breaks a constraint, that batch is
+    written row by row instead. When the queue is full the overflow policy
+    decides what happens: 'drop_oldest' discards the oldest queued row,
+    'drop_newest' discards the incoming row and 'block' makes the caller
+    wait for the flusher.
     """
-    ip_address = request.remote_addr
-    try:
-        db.execute(
-            "INSERT INTO logs (level, message, user_id, ip_address, details) VALUES (?, ?, ?, ?, ?)",
-            level, message, user_id, ip_address, details
-        )
-    except Exception as e:
-        print(f"Failed to log event: {e}")
 
+    POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, batch_size=100, flush_interval=0.5, max_size=10000, overflow='drop_oldest'):
+        if overflow not in self.POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.overflow = overflow
+        self.dropped = 0
+        self.written = 0
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='log-flusher', daemon=True)
+                self._thread.start()
+
+    def put(self, row):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        with self._cond:
+            if len(self._rows) >= self.max_size:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return
+                if self.overflow == 'drop_oldest':
+                    self._rows.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.notify_all()
+                    while len(self._rows) >= self.max_size:
+                        self._cond.wait()
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Write everything queued so far. Safe to call from any thread."""
+        with self._write_lock:
+            with self._cond:
+                rows = list(self._rows)
+                self._rows.clear()
+                self._cond.notify_all()
+            if not rows:
+                return
+            try:
+                with db.transaction():
+                    db.executemany(INSERT_LOG, rows)
+                self.written += len(rows)
+            except sqlite3.IntegrityError:
+                # One bad row (usually a user deleted while their events were
+                # queued) must not take the rest of the batch down with it
+                self._write_one_by_one(rows)
+            except Exception as e:
+                print(f"Failed to log {len(rows)} events: {e}")
+
+    def _write_one_by_one(self, rows):
+        failed = 0
+        with db.transaction():
+            for row in rows:
+                try:
+                    db.execute(INSERT_LOG, *row)
+                except sqlite3.IntegrityError:
+                    # Keep the event, without the link to a user that is gone
+                    try:
+                        db.execute(INSERT_LOG, *row[:3], None, *row[4:])
+                    except sqlite3.IntegrityError:
+                        failed += 1
+                        continue
+                self.written += 1
+        if failed:
+            print(f"Failed to log {failed} events")
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        return {'queued': len(self._rows), 'written': self.written, 'dropped': self.dropped}
+
+    def _after_fork(self):
+        # A forked worker starts empty: queued rows stay with the parent, which
+        # flushes them, and the parent's locks may have been held mid-fork.
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self.dropped = 0
+        self.written = 0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._rows) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                db.release()
+                return
+
+
+log_buffer = LogBuffer(
+    batch_size=LOG_BATCH_SIZE,
+    flush_interval=LOG_FLUSH_INTERVAL_MS / 1000,
+    max_size=LOG_QUEUE_SIZE,
+    overflow=LOG_OVERFLOW_POLICY,
+)
+
+atexit.register(log_buffer.shutdown)
+os.register_at_fork(after_in_child=log_buffer._after_fork)
+
+
+def log_event(level, message, user_id=None, details=None):
+    """
+    Logs an event to the database. The row is queued and written in the
+    background, so this never waits on a database write.
+    """
+    ip_address = request.remote_addr if has_request_context() else None
+    # Same format and clock as the column's CURRENT_TIMESTAMP default
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    log_buffer.put((timestamp, level, message, user_id, ip_address, details))
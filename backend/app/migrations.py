@@ -0,0 +1,434 @@
+from datetime import datetime, timezone
+import click
+from .database import db
+from . import directory, clock
+
+
+def add_column(table, column, definition):
+    """ALTER TABLE ADD COLUMN that skips columns which already exist."""
+    def apply(db):
+        columns = {row[1] for row in db.query(f"PRAGMA table_info({table})", row_factory='tuple')}
+        if column not in columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return apply
+
+
+def backfill_epoch_ms(table, column, tz=clock.LOCAL_TZ):
+    """Migration step: fill `<column>_ms` from a TEXT timestamp column written in `tz` (None: server local time)."""
+    def apply(db):
+        rows = db.query(f"SELECT id, {column} FROM {table} WHERE {column}_ms IS NULL AND {column} IS NOT NULL", row_factory='tuple')
+        db.executemany(
+            f"UPDATE {table} SET {column}_ms = ? WHERE id = ?",
+            [(clock.parse_ms(text, tz), row_id) for row_id, text in rows]
+        )
+    return apply
+
+def reread_epoch_ms(table, column, version, tz=None):
+    """
+    Migration step: recompute `<column>_ms` in `tz` (None: server local time)
+    for the rows that migration `version` backfilled in TIMEZONE, i.e. rows
+    written before it ran whose value is still that TIMEZONE reading.
+    """
+    def apply(db):
+        applied = db.execute("SELECT applied_at FROM schema_migrations WHERE version = ?", version)
+        if not applied:
+            return
+        applied_ms = clock.parse_ms(applied[0]['applied_at'], timezone.utc)
+        rows = db.query(f"SELECT id, {column}, {column}_ms FROM {table} WHERE {column}_ms IS NOT NULL", row_factory='tuple')
+        updates = []
+        for row_id, text, ms in rows:
+            reread = clock.parse_ms(text, tz)
+            if reread is not None and reread < applied_ms and ms == clock.parse_ms(text) and ms != reread:
+                updates.append((reread, row_id))
+        db.executemany(f"UPDATE {table} SET {column}_ms = ? WHERE id = ?", updates)
+    return apply
+
+# Versioned schema changes, applied in order and recorded in schema_migrations.
+# Never edit a migration that has shipped; add a new one instead. Every
+# statement is idempotent so databases that were patched by hand still migrate.
+MIGRATIONS = [
+    (1, 'baseline schema', [
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            password TEXT NOT NULL,
+            phone_number TEXT NOT NULL UNIQUE,
+            balance REAL NOT NULL DEFAULT 0,
+            has_card INTEGER NOT NULL DEFAULT 0, -- 0 for false, 1 for true
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            device_token TEXT,
+            auth_token TEXT,
+            login_pin TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_type TEXT NOT NULL,
+            sender_id INTEGER NOT NULL,
+            receiver_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT DEFAULT 'completed',
+            note TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            transaction_id VARCHAR(50) NULL,
+            FOREIGN KEY (receiver_id) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            card_number TEXT NOT NULL UNIQUE,
+            expiry_date TEXT NOT NULL,
+            cvc TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            card_type TEXT,
+            is_frozen INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS beneficiaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            beneficiary_id INTEGER NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (beneficiary_id) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            level TEXT NOT NULL, -- e.g., 'INFO', 'WARNING', 'ERROR'
+            message TEXT NOT NULL,
+            user_id INTEGER,
+            ip_address TEXT,
+            details TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE TABLE IF NOT EXISTS coupons (id INTEGER PRIMARY KEY AUTOINCREMENT, coupon_code TEXT UNIQUE NOT NULL, amount REAL NOT NULL)",
+        """CREATE TABLE IF NOT EXISTS notification_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            target_type TEXT NOT NULL,
+            recipient_id INTEGER,
+            recipient_count INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            sent_at TEXT NOT NULL
+        )""",
+    ]),
+    (2, 'dashboard counters, id sequences and qr scans', [
+        # Materialized counters for the admin dashboard, see app/stats.py
+        "CREATE TABLE IF NOT EXISTS dashboard_stats (name TEXT PRIMARY KEY, value REAL NOT NULL DEFAULT 0)",
+        # Sequence blocks handed out to the transaction ID generator, see app/txn_ids.py
+        "CREATE TABLE IF NOT EXISTS id_sequences (name TEXT PRIMARY KEY, next_value INTEGER NOT NULL)",
+        # Scanned QR codes, trimmed per user by app/qr_scans.py
+        """CREATE TABLE IF NOT EXISTS qr_scans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            raw_data TEXT NOT NULL,
+            parsed_data TEXT,
+            timestamp TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )""",
+    ]),
+    (3, 'history, dashboard and qr indexes', [
+        # Transaction history, one index per side of the UNION ALL
+        "CREATE INDEX IF NOT EXISTS idx_transactions_sender_type_time ON transactions (sender_id, transaction_type, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_receiver_type_time ON transactions (receiver_id, transaction_type, timestamp)",
+        # Admin dashboard: recent transactions and newest users
+        "CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+        # Per-user QR scan history in insertion order
+        "CREATE INDEX IF NOT EXISTS idx_qr_scans_user_id ON qr_scans (user_id, id)",
+        # One 'sent' row per transfer, so its transaction_id must be unique
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_sent_transaction_id ON transactions (transaction_id) WHERE transaction_type = 'sent'",
+    ]),
+    (4, 'drop leftover transactions_new', [
+        # Left behind by a hand-run rebuild of the transactions table
+        "DROP TABLE IF EXISTS transactions_new",
+    ]),
+    (5, 'foreign key and lookup indexes', [
+        # users.phone_number and users.email are already covered by their UNIQUE autoindexes
+        "CREATE INDEX IF NOT EXISTS idx_transactions_transaction_id ON transactions (transaction_id)",
+        "CREATE INDEX IF NOT EXISTS idx_beneficiaries_user_beneficiary ON beneficiaries (user_id, beneficiary_id)",
+        "CREATE INDEX IF NOT EXISTS idx_beneficiaries_beneficiary_id ON beneficiaries (beneficiary_id)",
+        "CREATE INDEX IF NOT EXISTS idx_cards_user_id ON cards (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_notification_logs_sent_at ON notification_logs (sent_at)",
+    ]),
+    (6, 'idempotency keys', [
+        # Stored responses for retried requests, see app/idempotency.py
+        """CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            status_code INTEGER,
+            response_body TEXT,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            UNIQUE (user_id, idempotency_key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at)",
+    ]),
+    (7, 'resumable broadcasts', [
+        # Progress of a broadcast to every device, see app/broadcast.py
+        add_column('notification_logs', 'payload', 'TEXT'),
+        add_column('notification_logs', 'cursor_user_id', 'INTEGER'),
+        add_column('notification_logs', 'chunks_done', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('notification_logs', 'failed_count', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('notification_logs', 'pruned_count', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('notification_logs', 'lease_until', 'REAL'),
+        add_column('notification_logs', 'finished_at', 'TEXT'),
+        # Registered devices in id order, for streaming tokens by keyset
+        "CREATE INDEX IF NOT EXISTS idx_users_device_token ON users (id, device_token) WHERE device_token IS NOT NULL",
+    ]),
+    (8, 'coupon redemptions, usage caps and expiry', [
+        # One row per (coupon, user); the UNIQUE constraint is the duplicate check, see app/coupons.py
+        """CREATE TABLE IF NOT EXISTS coupon_redemptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            coupon_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            redeemed_at TEXT NOT NULL,
+            UNIQUE (coupon_id, user_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_coupon_redemptions_user_id ON coupon_redemptions (user_id)",
+        add_column('coupons', 'max_uses', 'INTEGER'),  # NULL for unlimited
+        add_column('coupons', 'uses', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('coupons', 'expires_at', 'TEXT'),  # local time, NULL for never
+        # Earlier redemptions live only in the ledger; keep the first one per user if a race doubled it
+        """INSERT OR IGNORE INTO coupon_redemptions (coupon_id, user_id, amount, redeemed_at)
+           SELECT sender_id, receiver_id, amount, COALESCE(timestamp, '') FROM transactions
+           WHERE transaction_type = 'redeemed' ORDER BY id""",
+        "UPDATE coupons SET uses = (SELECT COUNT(*) FROM coupon_redemptions r WHERE r.coupon_id = coupons.id)",
+    ]),
+    (9, 'canonical phone numbers', [
+        # E.164 form of phone_number for recipient lookups, see app/directory.py.
+        # Not UNIQUE: older rows may hold one number in two formats.
+        add_column('users', 'phone_e164', 'TEXT'),
+        directory.backfill,
+        "CREATE INDEX IF NOT EXISTS idx_users_phone_e164 ON users (phone_e164)",
+    ]),
+    (10, 'hashed phone numbers', [
+        # SHA-256 of phone_e164 for contact matching, see directory.match
+        add_column('users', 'phone_hash', 'TEXT'),
+        directory.backfill_hashes,
+        "CREATE INDEX IF NOT EXISTS idx_users_phone_hash ON users (phone_hash)",
+    ]),
+    (11, 'balance snapshots', [
+        # Ledger balances as of a transactions.id checkpoint, see app/ledger.py
+        """CREATE TABLE IF NOT EXISTS balance_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ledger_rowid INTEGER NOT NULL,
+            ledger_rows INTEGER NOT NULL,
+            users_count INTEGER NOT NULL,
+            balance_total REAL NOT NULL,
+            drift_count INTEGER NOT NULL,
+            taken_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS balance_snapshot_entries (
+            snapshot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (snapshot_id, user_id)
+        ) WITHOUT ROWID""",
+    ]),
+    (12, 'epoch millisecond timestamps', [
+        # Integer copies of the local TEXT timestamps for sorting, range scans
+        # and relative times without parsing, see app/clock.py
+        add_column('users', 'created_at_ms', 'INTEGER'),
+        add_column('transactions', 'timestamp_ms', 'INTEGER'),
+        add_column('notification_logs', 'sent_at_ms', 'INTEGER'),
+        backfill_epoch_ms('users', 'created_at'),
+        backfill_epoch_ms('transactions', 'timestamp'),
+        backfill_epoch_ms('notification_logs', 'sent_at'),
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at_ms ON users (created_at_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_timestamp_ms ON transactions (timestamp_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_notification_logs_sent_at_ms ON notification_logs (sent_at_ms)",
+        # Replaced by the indexes above
+        "DROP INDEX IF EXISTS idx_users_created_at",
+        "DROP INDEX IF EXISTS idx_transactions_timestamp",
+        "DROP INDEX IF EXISTS idx_notification_logs_sent_at",
+    ]),
+    (13, 'user data versions', [
+        # Bumped by every write that changes a user's polled endpoints; the ETag source, see app/etags.py
+        "CREATE TABLE IF NOT EXISTS user_versions (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL)",
+    ]),
+    (14, 'idempotency effects', [
+        # Result of the money movement, written in its transaction, see idempotency.record_effect
+        add_column('idempotency_keys', 'effect', 'TEXT'),
+    ]),
+    (15, 'ledger adjustments', [
+        # What deleted ledger rows had added to the remaining users' balances, see ledger.record_removal
+        """CREATE TABLE IF NOT EXISTS ledger_adjustments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+        add_column('balance_snapshots', 'adjustment_rowid', 'INTEGER NOT NULL DEFAULT 0'),
+    ]),
+    (16, 'shared attempt limits', [
+        # Login, signup and contact match attempts, shared by every worker process, see passwords.AttemptLimiter
+        "CREATE TABLE IF NOT EXISTS attempt_hits (limiter TEXT NOT NULL, key TEXT NOT NULL, hit_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_attempt_hits_key ON attempt_hits (limiter, key, hit_at)",
+    ]),
+    (17, 'history indexes on timestamp_ms', [
+        # One partial index per side of the history, in the order a page is
+        # read, so a page seeks to its cursor and sorts nothing
+        backfill_epoch_ms('transactions', 'timestamp'),
+        "CREATE INDEX IF NOT EXISTS idx_transactions_sent_history ON transactions (sender_id, timestamp_ms) "
+        "WHERE transaction_type IN ('sent', 'transfer')",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_received_history ON transactions (receiver_id, timestamp_ms) "
+        "WHERE transaction_type IN ('received', 'transfer', 'redeemed')",
+    ]),
+    (18, 'notification times in server local time', [
+        # Notifications used to be stamped with a naive datetime.now(), the
+        # server's own local time rather than TIMEZONE, but migration 12 read
+        # them as TIMEZONE
+        reread_epoch_ms('notification_logs', 'sent_at', 12),
+    ]),
+]
+
+
+def _ensure_migrations_table():
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)"
+    )
+
+
+def applied_versions():
+    _ensure_migrations_table()
+    return {row[0] for row in db.query("SELECT version FROM schema_migrations", row_factory='tuple')}
+
+
+def pending():
+    applied = applied_versions()
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def migrate():
+    """
+    Apply every pending migration, each in its own transaction. Safe to run
+    from several processes at once: the version is re-checked under the
+    write lock, so each migration runs exactly once.
+    """
+    _ensure_migrations_table()
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        with db.transaction(immediate=True):
+            if db.execute("SELECT 1 FROM schema_migrations WHERE version = ?", version):
+                continue
+            for statement in statements:
+                if callable(statement):
+                    statement(db)
+                else:
+                    db.execute(statement)
+            db.execute(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                version, name, datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            )
+        applied.append((version, name))
+    return applied
+
+
+def hot_queries():
+    """The statements behind the busiest endpoints, with sample parameters."""
+    from .api.transactions import HISTORY_SQL, HISTORY_PAGE_SQL
+    sent_sql, received_sql = HISTORY_SQL
+    sent_page_sql, received_page_sql = HISTORY_PAGE_SQL
+    return [
+        ('login / receiver lookup', "SELECT * FROM users WHERE phone_number = ?", ('03000000000',)),
+        ('directory lookup', "SELECT id, name, phone_number, device_token FROM users WHERE phone_e164 = ? ORDER BY id LIMIT 1", ('+923000000000',)),
+        ('directory batch lookup', "SELECT id, name, phone_number, device_token, phone_e164 FROM users WHERE phone_e164 IN (?, ?)", ('+923000000000', '+923000000001')),
+        ('contact match by hash', "SELECT id, name, phone_number, phone_e164, device_token, phone_hash FROM users WHERE phone_hash IN (?, ?)", ('0' * 64, 'f' * 64)),
+        ('user by id', "SELECT id, name, email, phone_number FROM users WHERE id = ?", (1,)),
+        ('user data version', "SELECT version FROM user_versions WHERE user_id = ?", (1,)),
+        ('sent history', sent_sql, (1, 50)),
+        ('received history', received_sql, (1, 50)),
+        ('sent history page', sent_page_sql, (1, 1735671600000, 1735671600000, 1, 50)),
+        ('received history page', received_page_sql, (1, 1735671600000, 1735671600000, 1, 50)),
+        ('transaction by id', "SELECT * FROM transactions WHERE transaction_id = ?", ('0000000',)),
+        ('attempt limit', "SELECT hit_at FROM attempt_hits WHERE limiter = ? AND key = ? ORDER BY hit_at DESC LIMIT ?", ('account', 'phone:03000000000', 5)),
+        ('coupon by code', "SELECT id, amount FROM coupons WHERE coupon_code = ?", ('CODE',)),
+        ('coupon redemption by user', "SELECT id FROM coupon_redemptions WHERE coupon_id = ? AND user_id = ?", (1, 1)),
+        ('beneficiary exists', "SELECT * FROM beneficiaries WHERE user_id = ? AND beneficiary_id = ?", (1, 2)),
+        ('beneficiary list', "SELECT u.name, u.phone_number FROM beneficiaries b JOIN users u ON b.beneficiary_id = u.id WHERE b.user_id = ?", (1,)),
+        ('cards by user', "SELECT id FROM cards WHERE user_id = ?", (1,)),
+        ('logs by user', "SELECT * FROM logs WHERE user_id = ? ORDER BY id DESC LIMIT 50", (1,)),
+        ('notifications today', "SELECT COUNT(*) FROM notification_logs WHERE sent_at_ms >= ? AND sent_at_ms < ?", (1735671600000, 1735758000000)),
+        ('notification history', "SELECT * FROM notification_logs ORDER BY sent_at_ms DESC LIMIT 50", ()),
+        ('recent transactions', "SELECT * FROM transactions ORDER BY timestamp_ms DESC LIMIT 3", ()),
+        ('newest users', "SELECT name, created_at, created_at_ms FROM users ORDER BY created_at_ms DESC LIMIT 3", ()),
+        ('broadcast token chunk', "SELECT id, device_token FROM users WHERE device_token IS NOT NULL AND id > ? ORDER BY id LIMIT ?", (0, 500)),
+        ('latest qr scan', "SELECT id FROM qr_scans WHERE user_id = ? ORDER BY id DESC LIMIT 1", (1,)),
+    ]
+
+
+def explain(queries=None):
+    """
+    Run EXPLAIN QUERY PLAN for each hot query. Returns (name, plan lines,
+    problems) tuples; a problem is a SCAN of a real table without an index
+    or a temp B-tree built to sort or group the rows.
+    """
+    tables = {row[0] for row in db.query("SELECT name FROM sqlite_master WHERE type = 'table'", row_factory='tuple')}
+    report = []
+    for name, sql, params in queries or hot_queries():
+        plan = [row[3] for row in db.query(f"EXPLAIN QUERY PLAN {sql}", *params, row_factory='tuple')]
+        problems = [
+            line for line in plan
+            if (line.startswith('SCAN ') and 'USING' not in line and line.split()[1] in tables)
+            or line.startswith('USE TEMP B-TREE')
+        ]
+        report.append((name, plan, problems))
+    return report
+
+
+@click.group('schema')
+def schema_cli():
+    """Schema migrations and query plans."""
+
+
+@schema_cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    applied = migrate()
+    for version, name in applied:
+        click.echo(f"Applied {version}: {name}")
+    if not applied:
+        click.echo("Schema is up to date.")
+
+
+@schema_cli.command('status')
+def status_command():
+    """List applied and pending migrations."""
+    applied = applied_versions()
+    for version, name, _ in MIGRATIONS:
+        click.echo(f"{'applied' if version in applied else 'pending'}  {version}: {name}")
+
+
+@schema_cli.command('explain')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query.')
+def explain_command(verbose):
+    """Check the hot queries' plans; exits 1 if any scans a whole table or sorts in a temp B-tree."""
+    failed = False
+    for name, plan, problems in explain():
+        if problems:
+            failed = True
+            click.echo(f"SLOW PLAN  {name}: {'; '.join(problems)}")
+        elif verbose:
+            click.echo(f"ok         {name}")
+        if verbose:
+            for line in plan:
+                click.echo(f"               {line}")
+    if failed:
+        raise SystemExit(1)
+    click.echo("No full table scans or temp B-trees in the hot queries.")
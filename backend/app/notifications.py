@@ -0,0 +1,293 @@
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from .config import (
+    BASE_DIR,
+    NOTIFICATION_TRANSPORT,
+    NOTIFICATION_WORKERS,
+    NOTIFICATION_QUEUE_SIZE,
+    NOTIFICATION_MAX_RETRIES,
+)
+
+# FCM rejects multicast messages with more than 500 tokens
+MAX_TOKENS_PER_SEND = 500
+
+# Per-token errors that will never succeed on retry
+PERMANENT_ERRORS = ('UnregisteredError', 'SenderIdMismatchError', 'InvalidArgumentError')
+
+
+class PushNotification:
+    """The payload of a push message, independent of who receives it."""
+
+    def __init__(self, title, body, data=None, android_icon=None, android_channel_id=None):
+        self.title = title
+        self.body = body
+        self.data = {str(k): str(v) for k, v in (data or {}).items()}
+        self.android_icon = android_icon
+        self.android_channel_id = android_channel_id
+
+    def key(self):
+        # Messages with the same key can be merged into one multicast
+        return (self.title, self.body, tuple(sorted(self.data.items())), self.android_icon, self.android_channel_id)
+
+
+class SendResult:
+    def __init__(self, token, success, error=None, message_id=None):
+        self.token = token
+        self.success = success
+        self.error = error
+        self.message_id = message_id
+
+    @property
+    def retryable(self):
+        return not self.success and self.error not in PERMANENT_ERRORS
+
+
+class Transport:
+    """Delivers one notification to up to MAX_TOKENS_PER_SEND device tokens."""
+
+    def send(self, notification, tokens):
+        """Return one SendResult per token, in the same order."""
+        raise NotImplementedError
+
+
+class FirebaseTransport(Transport):
+    def __init__(self, credentials_path=None):
+        self.credentials_path = credentials_path or f"{BASE_DIR}/instance/serviceAccountKey.json"
+        self._messaging = None
+        self._lock = threading.Lock()
+
+    def _get_messaging(self):
+        # firebase_admin and google-auth take ~150ms to import, so they are
+        # loaded by the first send rather than at startup
+        with self._lock:
+            if self._messaging is None:
+                import firebase_admin
+                from firebase_admin import credentials, messaging
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app(credentials.Certificate(self.credentials_path))
+                self._messaging = messaging
+        return self._messaging
+
+    def send(self, notification, tokens):
+        messaging = self._get_messaging()
+        android = None
+        if notification.android_icon or notification.android_channel_id:
+            android = messaging.AndroidConfig(
+                notification=messaging.AndroidNotification(
+                    icon=notification.android_icon,
+                    channel_id=notification.android_channel_id
+                )
+            )
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(title=notification.title, body=notification.body),
+            data=notification.data,
+            tokens=list(tokens),
+            android=android
+        )
+        response = messaging.send_each_for_multicast(message)
+        return [
+            SendResult(token, r.success, error=type(r.exception).__name__ if r.exception else None, message_id=r.message_id)
+            for token, r in zip(tokens, response.responses)
+        ]
+
+
+class FakeTransport(Transport):
+    """Records every send locally; used by benchmarks and tests instead of Firebase."""
+
+    def __init__(self, latency=0.0, failures=None):
+        self.latency = latency
+        self.failures = failures or {}  # token -> error name
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, notification, tokens):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.sent.append((notification, list(tokens)))
+        return [
+            SendResult(token, token not in self.failures, error=self.failures.get(token), message_id=None if token in self.failures else f"fake-{token}")
+            for token in tokens
+        ]
+
+
+class _Job:
+    def __init__(self, notification, tokens, callback):
+        self.notification = notification
+        self.tokens = tokens
+        self.callback = callback
+
+
+class NotificationDispatcher:
+    """
+    In-process push notification queue.
+
+    Request handlers call enqueue() and return immediately. A pool of
+    worker threads merges queued jobs that share a payload, for different
+    tokens, into one multicast, sends them through the transport and
+    retries transient per-token failures with exponential backoff.
+    """
+
+    def __init__(self, transport, workers=2, queue_size=10000, max_retries=3, backoff=0.5, batch_window=0.05):
+        self.transport = transport
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_window = batch_window
+        self.queue_size = queue_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.stats = {'enqueued': 0, 'dropped': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'batches': 0}
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name='notification-worker', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, notification, tokens, callback=None):
+        """
+        Queue a notification for delivery. `callback(results)` is called from
+        a worker thread once every token has a final result. Returns False if
+        the queue is full and the notification was dropped.
+        """
+        tokens = [token for token in dict.fromkeys(tokens) if token]
+        if not tokens:
+            return False
+        if not self._threads:
+            self.start()
+
+        for start in range(0, len(tokens), MAX_TOKENS_PER_SEND):
+            chunk = tokens[start:start + MAX_TOKENS_PER_SEND]
+            try:
+                self._queue.put_nowait(_Job(notification, chunk, callback))
+                self._bump('enqueued')
+            except queue.Full:
+                self._bump('dropped')
+                return False
+        return True
+
+    def join(self):
+        """Block until every queued notification has been processed."""
+        self._queue.join()
+
+    def shutdown(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for _ in self._threads:
+            self._queue.put(None)
+        self._threads = []
+
+    def _after_fork(self):
+        # Worker threads don't survive a fork and jobs queued before it are the
+        # parent's to deliver; start a forked worker with an empty queue.
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            jobs = [job] + self._collect_batch(job)
+            try:
+                self._deliver(jobs)
+            finally:
+                for _ in jobs:
+                    self._queue.task_done()
+
+    def _collect_batch(self, first):
+        # Pull more jobs with the same payload, up to one full multicast. A
+        # job for a token already in the batch is a separate message (two
+        # identical transfers to one receiver are two pushes), so it is
+        # left for a later multicast rather than merged into this one.
+        batch, leftovers = [], []
+        tokens = set(first.tokens)
+        key = first.notification.key()
+        deadline = time.monotonic() + self.batch_window
+        while len(tokens) < MAX_TOKENS_PER_SEND:
+            try:
+                job = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if (job is not None and job.notification.key() == key
+                    and len(tokens) + len(job.tokens) <= MAX_TOKENS_PER_SEND
+                    and tokens.isdisjoint(job.tokens)):
+                batch.append(job)
+                tokens.update(job.tokens)
+            else:
+                leftovers.append(job)
+                break
+        for job in leftovers:
+            # Put it back for another worker; it was already counted once by get()
+            self._queue.task_done()
+            self._queue.put(job)
+        return batch
+
+    def deliver(self, notification, tokens):
+        """
+        Send to at most MAX_TOKENS_PER_SEND tokens on the calling thread,
+        retrying transient failures. Returns {token: SendResult}.
+        """
+        pending = list(dict.fromkeys(tokens))
+        results = {}
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self._bump('retried', len(pending))
+                time.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+            try:
+                batch_results = self.transport.send(notification, pending)
+            except Exception as e:
+                batch_results = [SendResult(token, False, error=type(e).__name__) for token in pending]
+            self._bump('batches')
+            for result in batch_results:
+                results[result.token] = result
+            pending = [result.token for result in batch_results if result.retryable]
+            if not pending:
+                break
+
+        self._bump('sent', sum(1 for r in results.values() if r.success))
+        self._bump('failed', sum(1 for r in results.values() if not r.success))
+        return results
+
+    def _deliver(self, jobs):
+        results = self.deliver(jobs[0].notification, [token for job in jobs for token in job.tokens])
+        for job in jobs:
+            if job.callback:
+                try:
+                    job.callback([results[token] for token in job.tokens])
+                except Exception as e:
+                    print(f"ERROR: Notification callback failed: {e}")
+
+
+def _make_transport(name):
+    if name == 'fake':
+        return FakeTransport()
+    return FirebaseTransport()
+
+
+dispatcher = NotificationDispatcher(
+    _make_transport(NOTIFICATION_TRANSPORT),
+    workers=NOTIFICATION_WORKERS,
+    queue_size=NOTIFICATION_QUEUE_SIZE,
+    max_retries=NOTIFICATION_MAX_RETRIES,
+)
+
+atexit.register(dispatcher.shutdown)
+os.register_at_fork(after_in_child=dispatcher._after_fork)
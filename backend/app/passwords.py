@@ -0,0 +1,159 @@
+import atexit
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from .database import db
+from .config import (
+    PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING, PASSWORD_HASH_TIMEOUT,
+    LOGIN_ATTEMPT_WINDOW, LOGIN_ATTEMPTS_PER_PHONE, LOGIN_ATTEMPTS_PER_IP, SIGNUP_ATTEMPTS_PER_IP,
+)
+
+
+class HashingBusy(Exception):
+    """Too many hashes are already queued; the caller should answer 503."""
+
+
+class PasswordHasher:
+    """
+    Runs the password KDF in a small process pool so slow hashes neither
+    hold the GIL nor pile up on request threads.
+
+    At most `max_pending` hashes may be queued or running; further callers
+    wait up to `timeout` seconds for a slot and then get HashingBusy.
+    """
+
+    def __init__(self, method, workers=2, max_pending=32, timeout=5.0):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = os.getpid()
+        self._method_prefix = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # The parent's pool is unusable after a fork
+                self._pool = None
+                self._pid = os.getpid()
+            if self._pool is None:
+                # spawn: forking a process that runs background threads is unsafe
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def method_prefix(self):
+        """
+        `method` as Werkzeug writes it into hashes, with defaults filled in
+        ('scrypt' becomes 'scrypt:32768:8:1'). Worked out from one dummy hash.
+        """
+        if self._method_prefix is None:
+            self._method_prefix = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return self._method_prefix
+
+    def needs_rehash(self, password_hash):
+        """True when the hash was made with other parameters than `method`."""
+        return password_hash.split('$', 1)[0] != self.method_prefix()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class AttemptLimiter:
+    """
+    Sliding-window attempt counter: a key is blocked once it has
+    `max_attempts` hits within `window` seconds. Hits are stored in the
+    attempt_hits table, so every worker process shares the same counts;
+    rows older than the window are swept every PURGE_INTERVAL seconds.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self, name, max_attempts, window):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.window = window
+        self._purge_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def retry_after(self, key):
+        """Seconds until `key` may try again, or 0 if it is not blocked."""
+        hits = db.query(
+            "SELECT hit_at FROM attempt_hits WHERE limiter = ? AND key = ? ORDER BY hit_at DESC LIMIT ?",
+            self.name, key, self.max_attempts, row_factory='tuple'
+        )
+        if len(hits) < self.max_attempts:
+            return 0
+        wait = hits[-1][0] + self.window - time.time()
+        return math.ceil(wait) if wait > 0 else 0
+
+    def hit(self, key):
+        now = time.time()
+        db.execute("INSERT INTO attempt_hits (limiter, key, hit_at) VALUES (?, ?, ?)", self.name, key, now)
+        self._maybe_purge(now)
+
+    def reset(self, key):
+        db.execute("DELETE FROM attempt_hits WHERE limiter = ? AND key = ?", self.name, key)
+
+    def _maybe_purge(self, now):
+        if now - self._last_purge < self.PURGE_INTERVAL or not self._purge_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_purge = now
+            db.execute("DELETE FROM attempt_hits WHERE limiter = ? AND hit_at < ?", self.name, now - self.window)
+        finally:
+            self._purge_lock.release()
+
+
+hasher = PasswordHasher(
+    PASSWORD_HASH_METHOD,
+    workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    timeout=PASSWORD_HASH_TIMEOUT,
+)
+atexit.register(hasher.shutdown)
+
+account_limiter = AttemptLimiter('account', LOGIN_ATTEMPTS_PER_PHONE, LOGIN_ATTEMPT_WINDOW)
+ip_limiter = AttemptLimiter('ip', LOGIN_ATTEMPTS_PER_IP, LOGIN_ATTEMPT_WINDOW)
+signup_limiter = AttemptLimiter('signup', SIGNUP_ATTEMPTS_PER_IP, LOGIN_ATTEMPT_WINDOW)
+
+
+def hash_password(password):
+    return hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    return hasher.verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    return hasher.needs_rehash(password_hash)
+
+
+def retry_after(*checks):
+    """Largest wait over (limiter, key) pairs; 0 when none is blocked."""
+    return max(limiter.retry_after(key) for limiter, key in checks)
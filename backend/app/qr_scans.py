@@ -0,0 +1,58 @@
+import json
+from .database import db
+from .config import QR_SCAN_RETENTION
+
+
+def _to_record(row):
+    return {
+        'id': row['id'],
+        'user_id': row['user_id'],
+        'raw_data': row['raw_data'],
+        'parsed_data': json.loads(row['parsed_data']) if row['parsed_data'] is not None else None,
+        'timestamp': row['timestamp'],
+    }
+
+
+def add_scan(user_id, raw_data, parsed_data=None, timestamp=None):
+    """Store a scan and trim the user's history to the newest QR_SCAN_RETENTION rows."""
+    parsed_json = json.dumps(parsed_data) if parsed_data is not None else None
+    with db.transaction():
+        scan_id = db.execute(
+            "INSERT INTO qr_scans (user_id, raw_data, parsed_data, timestamp) VALUES (?, ?, ?, ?)",
+            user_id, raw_data, parsed_json, timestamp
+        )
+        db.execute(
+            "DELETE FROM qr_scans WHERE user_id = ? AND id <= "
+            "(SELECT id FROM qr_scans WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            user_id, user_id, QR_SCAN_RETENTION
+        )
+    return {
+        'id': scan_id,
+        'user_id': user_id,
+        'raw_data': raw_data,
+        'parsed_data': parsed_data,
+        'timestamp': timestamp,
+    }
+
+
+def latest_scan(user_id):
+    rows = db.execute(
+        "SELECT id, user_id, raw_data, parsed_data, timestamp FROM qr_scans WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        user_id
+    )
+    return _to_record(rows[0]) if rows else None
+
+
+def list_scans(user_id, before_id=None, limit=20):
+    """Newest first; pass the last id of a page as before_id for the next one."""
+    if before_id is None:
+        rows = db.execute(
+            "SELECT id, user_id, raw_data, parsed_data, timestamp FROM qr_scans WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            user_id, limit
+        )
+    else:
+        rows = db.execute(
+            "SELECT id, user_id, raw_data, parsed_data, timestamp FROM qr_scans WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            user_id, before_id, limit
+        )
+    return [_to_record(row) for row in rows]
@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+import click
+from .config import BASE_DIR
+
+# What a worker does on boot
+STARTUP_STATEMENT = "import app; app.create_app()"
+
+
+def profile_imports(statement=STARTUP_STATEMENT):
+    """
+    Run `statement` in a fresh interpreter under -X importtime. Returns one
+    (module, self microseconds, cumulative microseconds) tuple per import,
+    in the order the imports finished.
+    """
+    env = dict(os.environ, NOTIFICATION_TRANSPORT=os.environ.get('NOTIFICATION_TRANSPORT', 'fake'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=BASE_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise click.ClickException(f"Startup failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header row
+        imports.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return imports
+
+
+def by_package(imports):
+    """Self time summed per top-level package, largest first."""
+    totals = {}
+    for module, self_us, _ in imports:
+        package = module.split('.', 1)[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+@click.group('startup')
+def startup_cli():
+    """Cold start profiling."""
+
+
+@startup_cli.command('imports')
+@click.option('--top', default=15, show_default=True, help='Rows per table.')
+@click.option('--budget-ms', type=float, help='Exit 1 if importing takes longer than this.')
+def imports_command(top, budget_ms):
+    """Per-package and per-module import time of create_app in a fresh interpreter."""
+    imports = profile_imports()
+    total_ms = sum(self_us for _, self_us, _ in imports) / 1000
+
+    click.echo(f"{len(imports)} modules imported in {total_ms:.1f} ms\n")
+    click.echo(f"{'package':<40}{'self ms':>10}{'share':>8}")
+    for package, self_us in by_package(imports)[:top]:
+        click.echo(f"{package:<40}{self_us / 1000:>10.1f}{self_us / 1000 / total_ms:>8.0%}")
+
+    click.echo(f"\n{'module':<40}{'cumulative ms':>14}")
+    for module, _, cumulative_us in sorted(imports, key=lambda item: item[2], reverse=True)[:top]:
+        click.echo(f"{module:<40}{cumulative_us / 1000:>14.1f}")
+
+    if budget_ms is not None and total_ms > budget_ms:
+        click.echo(f"\nImporting took {total_ms:.1f} ms, over the {budget_ms:.0f} ms budget.")
+        raise SystemExit(1)
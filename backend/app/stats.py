@@ -0,0 +1,102 @@
+import click
+from .database import db
+
+# Each counter and the query that computes it from the base tables
+COUNTERS = {
+    'users_count': "SELECT COUNT(*) FROM users",
+    'cards_count': "SELECT COUNT(*) FROM cards",
+    'balance_total': "SELECT COALESCE(SUM(balance), 0) FROM users",
+    'transactions_count': "SELECT COUNT(*) FROM transactions",
+    'transactions_amount_total': "SELECT COALESCE(SUM(amount), 0) FROM transactions",
+}
+
+
+def increment(**deltas):
+    """
+    Adjust counters by the given amounts, e.g. increment(users_count=1).
+    Runs inside the caller's transaction when there is one.
+    """
+    db.executemany(
+        "UPDATE dashboard_stats SET value = value + ? WHERE name = ?",
+        [(delta, name) for name, delta in deltas.items() if delta]
+    )
+
+
+def compute():
+    """Recompute every counter from the base tables (full scans)."""
+    return {name: db.query(sql, row_factory='tuple')[0][0] for name, sql in COUNTERS.items()}
+
+
+def refresh():
+    with db.transaction(immediate=True):
+        actual = compute()
+        db.executemany(
+            "INSERT INTO dashboard_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            list(actual.items())
+        )
+    return actual
+
+
+def _stored():
+    return {row[0]: row[1] for row in db.query("SELECT name, value FROM dashboard_stats", row_factory='tuple')}
+
+
+def read():
+    """Current counter values; seeds the table on first use."""
+    values = _stored()
+    if any(name not in values for name in COUNTERS):
+        values = refresh()
+    return values
+
+
+def dashboard_metrics():
+    values = read()
+    count = values['transactions_count']
+    return {
+        'total_users': int(values['users_count']),
+        'cards_issued': int(values['cards_count']),
+        'total_volume': int(round(values['balance_total'], 2)),
+        'average_transaction': round(values['transactions_amount_total'] / count, 2) if count else 0,
+    }
+
+
+def reconcile(fix=False):
+    """
+    Compare the stored counters with the base tables. Returns the counters
+    that drifted as {name: (stored, actual)}; with fix=True they are reset.
+    """
+    read()
+    # Read both sides from one snapshot so concurrent writes don't show up as drift
+    with db.transaction():
+        stored = _stored()
+        actual = compute()
+    drift = {
+        name: (stored.get(name), actual[name])
+        for name in COUNTERS
+        if abs((stored.get(name) or 0) - actual[name]) > 1e-6
+    }
+    if drift and fix:
+        refresh()
+    return drift
+
+
+@click.group('stats')
+def stats_cli():
+    """Dashboard counters."""
+
+
+@stats_cli.command('reconcile')
+@click.option('--fix', is_flag=True, help='Reset counters that drifted.')
+def reconcile_command(fix):
+    """Check the dashboard counters against the base tables."""
+    drift = reconcile(fix=fix)
+    if not drift:
+        click.echo("Dashboard counters are consistent.")
+        return
+    for name, (stored, actual) in drift.items():
+        click.echo(f"{name}: stored {stored}, actual {actual}")
+    if fix:
+        click.echo("Counters reset from the base tables.")
+    else:
+        raise SystemExit(1)
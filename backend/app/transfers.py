@@ -0,0 +1,96 @@
+import sqlite3
+from .database import db
+from .txn_ids import next_transaction_id
+from . import stats, clock, etags, idempotency
+
+# Attempts before giving up on a transaction ID that collides with an
+# older, randomly generated one
+ID_ATTEMPTS = 5
+
+
+class TransferError(Exception):
+    pass
+
+
+class InsufficientBalance(TransferError):
+    pass
+
+
+class AccountNotFound(TransferError):
+    pass
+
+
+class ReceiverChanged(TransferError):
+    """The receiver no longer owns the phone number the sender looked up."""
+
+
+def transfer(sender_id, receiver_id, amount, timestamp, note='', transaction_id=None, claim=None, receiver_phone=None, timestamp_ms=None):
+    """
+    Move money between two users in a single BEGIN IMMEDIATE transaction.
+
+    The debit is a conditional UPDATE, so the balance check and the write
+    happen under the same lock and concurrent senders can't overdraw.
+    With `receiver_phone` (E.164) the credit only goes through while the
+    receiver still owns that number, else ReceiverChanged is raised.
+    `timestamp_ms` is the epoch-ms value of `timestamp`, as clock.stamp()
+    returns them together; it is only parsed from the text when missing.
+    A transaction ID is generated unless one is given. Returns the ID, the
+    sender's new balance and the rowids of both ledger rows; with an
+    idempotency `claim` the result is also recorded on it in the same
+    transaction.
+    """
+    for attempt in range(ID_ATTEMPTS):
+        # Generated before BEGIN so a block reservation never waits on our own lock
+        txn_id = transaction_id or next_transaction_id()
+        try:
+            return _transfer(sender_id, receiver_id, amount, txn_id, timestamp, timestamp_ms, note, claim, receiver_phone)
+        except sqlite3.IntegrityError as e:
+            if transaction_id or 'transaction_id' not in str(e) or attempt == ID_ATTEMPTS - 1:
+                raise
+
+
+def _transfer(sender_id, receiver_id, amount, transaction_id, timestamp, timestamp_ms, note, claim, receiver_phone):
+    if timestamp_ms is None:
+        timestamp_ms = clock.parse_ms(timestamp)
+    with db.transaction(immediate=True):
+        debited = db.execute(
+            "UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? RETURNING balance",
+            amount, sender_id, amount
+        )
+        if not debited:
+            if not db.execute("SELECT id FROM users WHERE id = ?", sender_id):
+                raise AccountNotFound("Sender not found")
+            raise InsufficientBalance("Insufficient balance")
+
+        if receiver_phone is None:
+            credited = db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", amount, receiver_id)
+        else:
+            credited = db.execute(
+                "UPDATE users SET balance = balance + ? WHERE id = ? AND phone_e164 = ?",
+                amount, receiver_id, receiver_phone
+            )
+        if not credited:
+            if receiver_phone is not None and db.execute("SELECT id FROM users WHERE id = ?", receiver_id):
+                raise ReceiverChanged("Receiver's phone number has changed")
+            raise AccountNotFound("Receiver not found")
+
+        # One ledger row per side of the transfer, sharing the transaction_id
+        sender_record_id = db.execute(
+            "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp, timestamp_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            transaction_id, 'sent', sender_id, receiver_id, amount, 'completed', note, timestamp, timestamp_ms
+        )
+        receiver_record_id = db.execute(
+            "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp, timestamp_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            transaction_id, 'received', sender_id, receiver_id, amount, 'completed', note, timestamp, timestamp_ms
+        )
+        stats.increment(transactions_count=2, transactions_amount_total=2 * amount)
+        etags.bump(sender_id, receiver_id)
+
+        result = {
+            "transaction_id": transaction_id,
+            "new_balance": float(debited[0]['balance']),
+            "sender_record_id": sender_record_id,
+            "receiver_record_id": receiver_record_id,
+        }
+        idempotency.record_effect(claim, result)
+    return result
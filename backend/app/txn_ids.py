@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from .config import DATABASE_PATH, DATABASE_BUSY_TIMEOUT_MS, JWT_SECRET, TXN_ID_KEY, TXN_ID_BLOCK_SIZE
+
+# Customer-facing IDs are 7 hex characters, i.e. exactly 28 bits
+ID_BITS = 28
+HALF_BITS = ID_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+class TransactionIdGenerator:
+    """
+    Collision-free 7-character transaction IDs without a database probe.
+
+    Each process reserves blocks of sequence numbers from the id_sequences
+    table (one UPDATE per block) and hands them out from memory. Every
+    sequence number is then scrambled by a keyed 28-bit Feistel network,
+    which is a permutation, so distinct numbers always give distinct IDs
+    while consecutive transfers still get unrelated-looking IDs.
+
+    The key must never change once IDs have been issued with it.
+    """
+
+    def __init__(self, path, key, block_size=64, sequence='transaction_id'):
+        self.path = path
+        self.key = key.encode() if isinstance(key, str) else key
+        self.block_size = block_size
+        self.sequence = sequence
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._pid = os.getpid()
+
+    def next_id(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child must not reuse the parent's block
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+            value = self._next
+            self._next += 1
+        return format_id(permute(value, self.key))
+
+    def _reserve_block(self):
+        start, end = reserve(self.path, self.sequence, self.block_size)
+        if end > (1 << ID_BITS):
+            raise RuntimeError("Transaction ID space exhausted")
+        return start, end
+
+
+def reserve(path, sequence, count):
+    """Claim the next `count` values of an id_sequences counter; returns (start, end)."""
+    # Own short-lived connection: the reservation must commit on its own,
+    # even when the caller is inside a transaction that later rolls back.
+    conn = sqlite3.connect(path, timeout=DATABASE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    try:
+        conn.execute("INSERT OR IGNORE INTO id_sequences (name, next_value) VALUES (?, 0)", (sequence,))
+        end = conn.execute(
+            "UPDATE id_sequences SET next_value = next_value + ? WHERE name = ? RETURNING next_value",
+            (count, sequence)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    return end - count, end
+
+
+def _round_function(key, round_number, half):
+    digest = hashlib.blake2b(half.to_bytes(2, 'big'), key=key, digest_size=4, person=bytes([round_number]) * 16).digest()
+    return int.from_bytes(digest, 'big') & HALF_MASK
+
+
+def permute(value, key):
+    """Keyed bijection on [0, 2**28)."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_number in range(ROUNDS):
+        left, right = right, left ^ _round_function(key, round_number, right)
+    return (left << HALF_BITS) | right
+
+
+def unpermute(value, key):
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for round_number in reversed(range(ROUNDS)):
+        left, right = right ^ _round_function(key, round_number, left), left
+    return (left << HALF_BITS) | right
+
+
+def format_id(value):
+    return f"{value:07X}"
+
+
+generator = TransactionIdGenerator(
+    DATABASE_PATH,
+    key=hashlib.sha256((TXN_ID_KEY or JWT_SECRET or 'flexpay').encode()).digest()[:32],
+    block_size=TXN_ID_BLOCK_SIZE,
+)
+
+
+def next_transaction_id():
+    return generator.next_id()
@@ -1,8 +1,49 @@
 import jwt
+import time
 from functools import wraps
 from flask import request, jsonify
 from .database import db
-from .config import JWT_SECRET
+from .cache import TTLCache
+from .config import JWT_SECRET, AUTH_CACHE_TTL, AUTH_CACHE_SIZE
+
+# Decoded token payloads, keyed by the raw token
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# User principal rows (no password hash or tokens), keyed by user id
+user_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def decode_token(token):
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        # Never keep a token cached past its own expiry
+        ttl = AUTH_CACHE_TTL
+        if 'exp' in data:
+            ttl = min(ttl, data['exp'] - time.time())
+        if ttl > 0:
+            token_cache.set(token, data, ttl=ttl)
+    return data
+
+
+def load_user(user_id):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = db.execute("SELECT id, name, email, phone_number FROM users WHERE id = ?", user_id)[0]
+        user_cache.set(user_id, user)
+    return dict(user)
+
+
+def invalidate_user(user_id):
+    """Drop a cached user row; call after any write that changes it."""
+    user_cache.delete(user_id)
+
+
+def auth_cache_stats():
+    return {
+        'tokens': token_cache.stats(),
+        'users': user_cache.stats(),
+    }
+
 
 def auth_token_required(f):
     @wraps(f)
@@ -13,10 +54,10 @@ def auth_token_required(f):
         if not token:
             return jsonify({'message': 'Auth token is missing!'}), 401
         try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+            data = decode_token(token)
             if data.get('type') != 'auth':
                 return jsonify({'message': 'Invalid token type!'}), 401
-            current_user = db.execute("SELECT * FROM users WHERE id = ?", data['user_id'])[0]
+            current_user = load_user(data['user_id'])
         except Exception as e:
             return jsonify({'message': 'Auth token is invalid!'}), 401
         return f(current_user, *args, **kwargs)
@@ -31,11 +72,18 @@ def session_token_required(f):
         if not token:
             return jsonify({'message': 'Session token is missing!'}), 401
         try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+            data = decode_token(token)
             if data.get('type') != 'session':
                 return jsonify({'message': 'Invalid token type!'}), 401
-            current_user = db.execute("SELECT * FROM users WHERE id = ?", data['user_id'])[0]
+            current_user = load_user(data['user_id'])
         except Exception as e:
             return jsonify({'message': 'Session token is invalid!'}), 401
         return f(current_user, *args, **kwargs)
     return decorated
+
+
+def too_many_attempts(retry_after):
+    """429 response for a client that hit an attempt limit."""
+    response = jsonify({"error": "Too many attempts. Please try again later."})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
@@ -0,0 +1,75 @@
+"""
+Benchmark for virtual card number generation.
+
+Generates numbers for every network and checks that each passes the Luhn
+check, has the network's prefix and length and is unique, times bulk
+issuance of cards to a batch of users, then compares the speed with Faker
+when it is installed.
+
+    python -m benchmarks.card_numbers --count 100000 --users 10000
+"""
+import argparse
+import os
+import sys
+
+from .common import Timer, create_database, seed_users, remove_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100_000, help='numbers per network')
+    parser.add_argument('--users', type=int, default=10_000, help='users in the bulk issuance batch')
+    args = parser.parse_args()
+
+    path = create_database()
+    try:
+        run(args)
+    finally:
+        remove_database(path)
+
+
+def run(args):
+    from app.migrations import migrate
+    from app import card_numbers, cards
+    migrate()
+
+    print(f"{'generator':<30}{'network':<12}{'numbers/s':>12}{'duplicates':>12}")
+    failed = False
+    for network, (prefixes, length) in card_numbers.NETWORKS.items():
+        with Timer() as timer:
+            numbers = card_numbers.card_numbers(network, args.count)
+        invalid = [
+            number for number in numbers
+            if len(number) != length or not number.startswith(prefixes) or not card_numbers.is_luhn_valid(number)
+        ]
+        if invalid:
+            failed = True
+            print(f"invalid {network} numbers, e.g. {invalid[:3]}")
+        if len(set(numbers)) != args.count:
+            failed = True
+        print(f"{'card_numbers':<30}{network:<12}{args.count / timer.elapsed:>12.0f}{args.count - len(set(numbers)):>12}")
+
+    user_ids = seed_users(os.environ['DATABASE_PATH'], args.users)
+    with Timer() as timer:
+        issued = cards.issue_many(user_ids, 'Visa')
+    if len(issued) != len(user_ids):
+        failed = True
+    print(f"{'issue_many':<30}{'visa':<12}{len(issued) / timer.elapsed:>12.0f}{'':>12}")
+
+    try:
+        from faker import Faker
+    except ImportError:
+        print("faker is not installed; skipping the comparison")
+    else:
+        fake = Faker()
+        for network in card_numbers.NETWORKS:
+            with Timer() as timer:
+                numbers = [fake.credit_card_number(card_type=network) for _ in range(args.count)]
+            print(f"{'faker':<30}{network:<12}{args.count / timer.elapsed:>12.0f}{args.count - len(set(numbers)):>12}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
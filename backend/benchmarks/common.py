@@ -0,0 +1,69 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks never touch instance/database.db. They build a throwaway
+database with the same schema and point the app at it through the
+DATABASE_PATH environment variable before anything from `app` is imported.
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SOURCE_DATABASE = os.path.join(BACKEND_DIR, 'instance', 'database.db')
+
+
+def create_database(path=None):
+    """Create an empty database with the app's schema and return its path."""
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix='flexpay-bench-', suffix='.db')
+        os.close(fd)
+        os.remove(path)
+
+    source = sqlite3.connect(SOURCE_DATABASE)
+    schema = source.execute(
+        "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END"
+    ).fetchall()
+    source.close()
+
+    conn = sqlite3.connect(path)
+    for (sql,) in schema:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+    os.environ['DATABASE_PATH'] = path
+    return path
+
+
+def seed_users(path, count, balance=1000.0):
+    """Insert `count` users with the same starting balance and return their ids."""
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (name, email, phone_number, password, balance, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (f"Bench User {i}", f"bench{i}@example.com", f"03{i:09d}", "x", balance, "2025-01-01 00:00:00")
+            for i in range(count)
+        )
+    )
+    conn.commit()
+    ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+    conn.close()
+    return ids
+
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,127 @@
+"""
+Contention benchmark for coupon redemption.
+
+Many threads redeem the same hot promo code at once, and every user tries
+more than once. Afterwards the script checks that no user was credited
+twice, that the usage cap held and that every balance matches the
+redemptions in the ledger.
+
+    python -m benchmarks.coupon_contention --users 200 --threads 8 --max-uses 100
+    python -m benchmarks.coupon_contention --legacy   # old check-then-write path, no caps
+"""
+import argparse
+import random
+import sqlite3
+import sys
+import threading
+
+from .common import create_database, seed_users, remove_database, Timer
+
+CODE = 'HOTPROMO'
+
+
+def legacy_redeem(db, user_id, coupon_code, timestamp):
+    # The statement sequence redeem_coupon used before the redemption engine
+    coupon = db.execute("SELECT id, coupon_code, amount FROM coupons WHERE coupon_code = ?", coupon_code)
+    coupon_id, amount = coupon[0]['id'], coupon[0]['amount']
+    if db.execute(
+        "SELECT id FROM transactions WHERE transaction_type = 'redeemed' AND receiver_id = ? AND sender_id = ?",
+        user_id, coupon_id
+    ):
+        return False
+    db.execute("SELECT balance, name FROM users WHERE id = ?", user_id)
+    with db.transaction():
+        db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", amount, user_id)
+        db.execute(
+            "INSERT INTO transactions (transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            'redeemed', coupon_id, user_id, amount, 'completed', coupon_code, timestamp
+        )
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=3, help='redemption attempts per user')
+    parser.add_argument('--max-uses', type=int, default=100, help='usage cap of the hot code (0 for unlimited)')
+    parser.add_argument('--amount', type=float, default=50.0)
+    parser.add_argument('--legacy', action='store_true', help='benchmark the old multi-statement path')
+    args = parser.parse_args()
+
+    path = create_database()
+    user_ids = seed_users(path, args.users, 0.0)
+
+    from app.database import db
+    from app.migrations import migrate
+    from app.coupons import redeem, RedemptionError
+    migrate()
+    db.execute(
+        "INSERT INTO coupons (coupon_code, amount, max_uses) VALUES (?, ?, ?)",
+        CODE, args.amount, args.max_uses or None
+    )
+    coupon_id = db.execute("SELECT id FROM coupons WHERE coupon_code = ?", CODE)[0]['id']
+
+    # Every user appears `attempts` times, shuffled across the threads
+    attempts = [user_id for user_id in user_ids for _ in range(args.attempts)]
+    random.Random(1).shuffle(attempts)
+    shares = [attempts[n::args.threads] for n in range(args.threads)]
+
+    counts = {'redeemed': 0, 'rejected': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(share):
+        barrier.wait()
+        for user_id in share:
+            outcome = 'redeemed'
+            try:
+                if args.legacy:
+                    if not legacy_redeem(db, user_id, CODE, '2025-01-01 00:00:00'):
+                        outcome = 'rejected'
+                else:
+                    redeem(user_id, CODE, '2025-01-01 00:00:00')
+            except RedemptionError:
+                outcome = 'rejected'
+            except sqlite3.Error:
+                outcome = 'errors'
+            with counts_lock:
+                counts[outcome] += 1
+        db.release()
+
+    threads = [threading.Thread(target=worker, args=(share,)) for share in shares]
+    with Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    per_user = {row['receiver_id']: row['n'] for row in db.execute(
+        "SELECT receiver_id, COUNT(*) AS n FROM transactions WHERE transaction_type = 'redeemed' AND sender_id = ? GROUP BY receiver_id",
+        coupon_id
+    )}
+    balances = {row['id']: row['balance'] for row in db.execute("SELECT id, balance FROM users")}
+    uses = db.execute("SELECT uses FROM coupons WHERE id = ?", coupon_id)[0]['uses']
+    db.close_all()
+    remove_database(path)
+
+    total = sum(per_user.values())
+    doubled = [user_id for user_id, n in per_user.items() if n > 1]
+    drifted = [user_id for user_id in balances if abs(balances[user_id] - per_user.get(user_id, 0) * args.amount) > 1e-6]
+    over_cap = bool(args.max_uses) and not args.legacy and total > args.max_uses
+
+    print(f"mode:            {'legacy' if args.legacy else 'redemption engine'}")
+    print(f"attempts:        {len(attempts)} by {args.users} users on {args.threads} threads in {timer.elapsed:.2f}s")
+    print(f"throughput:      {len(attempts) / timer.elapsed:.0f} attempts/s")
+    print(f"redeemed:        {counts['redeemed']}, rejected: {counts['rejected']}, errors: {counts['errors']}")
+    print(f"ledger rows:     {total}" + (f" (cap {args.max_uses}, coupon uses {uses})" if not args.legacy else ""))
+    print(f"double credits:  {len(doubled)} users")
+    print(f"balance drift:   {len(drifted)} users")
+
+    if counts['errors'] or doubled or drifted or over_cap or (not args.legacy and uses != total):
+        print("FAILED: double redemption, cap overrun or lost update detected")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
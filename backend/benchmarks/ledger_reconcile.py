@@ -0,0 +1,98 @@
+"""
+Benchmark for `flask ledger reconcile`.
+
+Seeds users and a ledger of transfers (1M rows by default) whose balances
+add up, plants drift on a few users, and then times a full replay, an
+incremental run after more transfers and a run with nothing new.
+
+    python -m benchmarks.ledger_reconcile --rows 1000000 --users 10000
+"""
+import argparse
+import random
+import sqlite3
+import sys
+
+from .common import create_database, seed_users, remove_database, Timer
+
+
+def seed_transfers(path, user_ids, rows, first, rng):
+    """Append rows // 2 transfers and apply them to users.balance."""
+    balances = {}
+
+    def generate():
+        for n in range(first, first + rows // 2):
+            sender, receiver = rng.sample(user_ids, 2)
+            amount = rng.randint(1, 500)
+            balances[sender] = balances.get(sender, 0) - amount
+            balances[receiver] = balances.get(receiver, 0) + amount
+            txn_id = f"{n:07X}"
+            yield (txn_id, 'sent', sender, receiver, amount, 'completed', '', '2025-01-01 00:00:00')
+            yield (txn_id, 'received', sender, receiver, amount, 'completed', '', '2025-01-01 00:00:00')
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        generate()
+    )
+    conn.executemany("UPDATE users SET balance = balance + ? WHERE id = ?", [(delta, user_id) for user_id, delta in balances.items()])
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--new-rows', type=int, default=20_000, help='ledger rows added before the incremental run')
+    parser.add_argument('--drifted', type=int, default=5, help='users whose balance is corrupted')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    path = create_database()
+    user_ids = seed_users(path, args.users, 0.0)
+    with Timer() as timer:
+        seed_transfers(path, user_ids, args.rows, 0, rng)
+    print(f"seeded {args.rows} ledger rows in {timer.elapsed:.1f}s")
+
+    drifted = set(rng.sample(user_ids, args.drifted))
+    conn = sqlite3.connect(path)
+    conn.executemany("UPDATE users SET balance = balance + 1 WHERE id = ?", [(user_id,) for user_id in drifted])
+    conn.commit()
+    conn.close()
+
+    from app.database import db
+    from app.migrations import migrate
+    from app import ledger
+    migrate()
+
+    results = []
+    failed = False
+
+    def run(label):
+        nonlocal failed
+        with Timer() as timer:
+            result = ledger.reconcile()
+        results.append((label, timer.elapsed, result['rows_scanned'], len(result['drift'])))
+        if set(result['drift']) != drifted:
+            failed = True
+
+    run("full replay")
+    seed_transfers(path, user_ids, args.new_rows, args.rows, rng)
+    run(f"incremental (+{args.new_rows} rows)")
+    run("incremental (no new rows)")
+
+    db.close_all()
+    remove_database(path)
+
+    print()
+    print(f"{'run':<35}{'seconds':>10}{'rows read':>12}{'drifted':>10}")
+    for label, seconds, scanned, drift in results:
+        print(f"{label:<35}{seconds:>10.2f}{scanned:>12}{drift:>10}")
+
+    if failed:
+        print(f"FAILED: expected exactly the {len(drifted)} corrupted users to drift")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+End-to-end load test for the Flask API.
+
+Seeds a throwaway database with users, transactions and coupons, swaps
+Firebase for the in-memory fake transport and then drives the same
+session a phone would run through create_app() from several threads:
+
+    login -> session refresh -> balance -> history -> send -> redeem coupon
+
+Latency percentiles and throughput per endpoint are printed as JSON.
+Save a run with --output and pass it as --baseline to a later run to fail
+when an endpoint's p95 got slower than the tolerance allows.
+
+    python -m benchmarks.load_test --users 1000 --transactions 100000 --concurrency 8 --duration 30
+    python -m benchmarks.load_test --output before.json
+    python -m benchmarks.load_test --baseline before.json --tolerance 0.2
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+from .common import create_database, remove_database, Timer
+
+PASSWORD = 'bench-password'
+ENDPOINTS = ('login', 'refresh', 'balance', 'history', 'send', 'redeem')
+
+
+def seed(path, users, transactions, coupons, password_hash, rng):
+    """Fill the benchmark database and return the seeded phone numbers and coupon codes."""
+    phones = [f"03{i:09d}" for i in range(users)]
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (name, email, phone_number, password, balance, created_at, device_token) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (f"Load User {i}", f"load{i}@example.com", phone, password_hash, 1_000_000.0, "2025-01-01 00:00:00", f"device-{i}")
+            for i, phone in enumerate(phones)
+        )
+    )
+    ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+
+    def ledger():
+        for i in range(transactions // 2):
+            sender_id, receiver_id = rng.sample(ids, 2)
+            amount = round(rng.uniform(1, 500), 2)
+            timestamp = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+            # Seeded IDs start with 'S' so they never collide with generated hex IDs
+            transaction_id = f"S{i:06X}"
+            for transaction_type in ('sent', 'received'):
+                yield (transaction_id, transaction_type, sender_id, receiver_id, amount, 'completed', 'seed', timestamp)
+
+    conn.executemany(
+        "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ledger()
+    )
+    codes = [f"LOAD{i:06d}" for i in range(coupons)]
+    conn.executemany("INSERT INTO coupons (coupon_code, amount) VALUES (?, ?)", ((code, 10.0) for code in codes))
+    conn.commit()
+    conn.close()
+    return phones, codes
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed):
+    endpoints = {}
+    for name in ENDPOINTS:
+        entries = samples[name]
+        latencies = sorted(latency for latency, _ in entries)
+        statuses = {}
+        for _, status in entries:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = {
+            'count': len(entries),
+            'errors': sum(1 for _, status in entries if status >= 500),
+            'status': statuses,
+            'rps': round(len(entries) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            'max_ms': round(latencies[-1] * 1000, 3) if latencies else None,
+        }
+    return endpoints
+
+
+def compare(report, baseline, tolerance):
+    """Endpoints whose p95 grew by more than `tolerance` relative to the baseline."""
+    regressions = {}
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous or not previous.get('p95_ms') or current['p95_ms'] is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions[name] = {'baseline_p95_ms': previous['p95_ms'], 'p95_ms': current['p95_ms']}
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--transactions', type=int, default=100_000, help='ledger rows to seed')
+    parser.add_argument('--coupons', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds to run')
+    parser.add_argument('--password-method', default=None, help='hash method for seeded users (default: PASSWORD_HASH_METHOD)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown against the baseline')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    path = create_database()
+    os.environ['NOTIFICATION_TRANSPORT'] = 'fake'
+    os.environ.setdefault('JWT_SECRET', 'load-test-secret')
+    # One client address: keep the per-IP limit out of the measurement
+    os.environ.setdefault('LOGIN_ATTEMPTS_PER_IP', str(10 ** 9))
+    if args.password_method:
+        os.environ['PASSWORD_HASH_METHOD'] = args.password_method
+
+    from werkzeug.security import generate_password_hash
+    from app.config import PASSWORD_HASH_METHOD
+    # Hashing is slow on purpose; every seeded user shares one hash
+    phones, codes = seed(path, args.users, args.transactions, args.coupons,
+                         generate_password_hash(PASSWORD, PASSWORD_HASH_METHOD), rng)
+
+    from app import create_app
+    from app.database import db
+    from app.logger import log_buffer
+    from app.notifications import dispatcher
+    # Anything the app prints goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        app = create_app()
+
+    samples = {name: [] for name in ENDPOINTS}
+    samples_lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(worker_seed):
+        thread_rng = random.Random(worker_seed)
+        client = app.test_client()
+        local = {name: [] for name in ENDPOINTS}
+
+        def call(name, method, url, **kwargs):
+            start = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            local[name].append((time.perf_counter() - start, response.status_code))
+            return response
+
+        while time.monotonic() < deadline:
+            phone = thread_rng.choice(phones)
+            response = call('login', 'POST', '/api/login', json={'phone_number': phone, 'password': PASSWORD})
+            if response.status_code != 200:
+                continue
+            auth = {'Authorization': f"Bearer {response.get_json()['auth_token']}"}
+            response = call('refresh', 'POST', '/api/session/refresh', headers=auth)
+            if response.status_code != 200:
+                continue
+            session = {'Authorization': f"Bearer {response.get_json()['session_token']}"}
+            call('balance', 'GET', '/api/balance', headers=session)
+            call('history', 'GET', '/api/transactions?limit=50', headers=session)
+            receiver = thread_rng.choice(phones)
+            while receiver == phone:
+                receiver = thread_rng.choice(phones)
+            call('send', 'POST', '/api/transactions/send', headers=session,
+                 json={'receiver_phone': receiver, 'amount': round(thread_rng.uniform(1, 50), 2), 'note': 'load test'})
+            if codes:
+                call('redeem', 'POST', '/api/coupons/redeem', headers=session, json={'coupon_code': thread_rng.choice(codes)})
+
+        with samples_lock:
+            for name in ENDPOINTS:
+                samples[name].extend(local[name])
+        db.release()
+
+    threads = [threading.Thread(target=worker, args=(args.seed * 1000 + n,)) for n in range(args.concurrency)]
+    with contextlib.redirect_stdout(sys.stderr), Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    dispatcher.join()
+    log_buffer.flush()
+    db.close_all()
+    remove_database(path)
+
+    total = sum(len(entries) for entries in samples.values())
+    report = {
+        'config': {
+            'users': args.users,
+            'transactions': args.transactions,
+            'coupons': args.coupons,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'password_method': PASSWORD_HASH_METHOD,
+        },
+        'elapsed_s': round(timer.elapsed, 3),
+        'requests': total,
+        'rps': round(total / timer.elapsed, 2),
+        'endpoints': summarize(samples, timer.elapsed),
+    }
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+        failed = bool(report['regressions'])
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
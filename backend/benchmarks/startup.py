@@ -0,0 +1,158 @@
+"""
+Startup benchmark for the production server.
+
+Measures how long a fresh interpreter takes to import the app and run
+create_app(), then how long gunicorn takes from launch until /healthz
+answers, with and without preloading the app in the master. Finally it
+sends SIGHUP while a client keeps polling /healthz and reports how long
+the graceful reload took and whether any request failed during it.
+
+    python -m benchmarks.startup --workers 4 --repeat 5
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from .common import BACKEND_DIR, create_database, remove_database
+
+COLD_START = (
+    "import time; start = time.perf_counter(); "
+    "from app import create_app; imported = time.perf_counter(); "
+    "create_app(); done = time.perf_counter(); "
+    "print(imported - start, done - imported)"
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def healthy(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def cold_start(env, repeat):
+    imports, creates = [], []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START], cwd=BACKEND_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout.split()
+        imports.append(float(output[-2]))
+        creates.append(float(output[-1]))
+    return statistics.median(imports), statistics.median(creates)
+
+
+class Server:
+    def __init__(self, env, workers, preload):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}/healthz"
+        self.log = tempfile.NamedTemporaryFile(prefix='flexpay-gunicorn-', suffix='.log', delete=False)
+        self.env = dict(env, PORT=str(self.port), WEB_CONCURRENCY=str(workers), WEB_PRELOAD='1' if preload else '0')
+
+    def start(self, timeout=60):
+        """Launch gunicorn and return the seconds until /healthz answered."""
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+            cwd=BACKEND_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=self.log
+        )
+        while not healthy(self.url):
+            if self.process.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError(f"gunicorn did not start, see {self.log.name}")
+            time.sleep(0.01)
+        return time.perf_counter() - start
+
+    def booted(self):
+        with open(self.log.name) as log:
+            return log.read().count('Booting worker')
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait(timeout=60)
+        self.log.close()
+        os.remove(self.log.name)
+
+
+def graceful_reload(server, workers, timeout=60):
+    """SIGHUP the master while polling; returns (seconds until replaced, requests, failures)."""
+    while server.booted() < workers:
+        time.sleep(0.01)
+    counts = {'requests': 0, 'failures': 0}
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            counts['requests'] += 1
+            if not healthy(server.url):
+                counts['failures'] += 1
+
+    poller = threading.Thread(target=poll)
+    poller.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    server.process.send_signal(signal.SIGHUP)
+    while server.booted() < 2 * workers and time.perf_counter() - start < timeout:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.2)
+    stop.set()
+    poller.join()
+    return elapsed, counts['requests'], counts['failures']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = create_database()
+    env = dict(os.environ, NOTIFICATION_TRANSPORT='fake')
+    env.setdefault('JWT_SECRET', 'startup-benchmark')
+
+    # The first create_app migrates the empty database; time the ones after it
+    cold_start(env, 1)
+    imported, created = cold_start(env, args.repeat)
+
+    results = []
+    for preload in (True, False):
+        times = []
+        for _ in range(args.repeat):
+            server = Server(env, args.workers, preload)
+            times.append(server.start())
+            server.stop()
+        results.append((f"gunicorn ready, preload={'on' if preload else 'off'}", statistics.median(times)))
+
+    server = Server(env, args.workers, True)
+    server.start()
+    reload_seconds, requests, failures = graceful_reload(server, args.workers)
+    server.stop()
+    remove_database(path)
+
+    print(f"{'step':<40}{'median s':>10}")
+    print(f"{'import app':<40}{imported:>10.3f}")
+    print(f"{'create_app()':<40}{created:>10.3f}")
+    for label, seconds in results:
+        print(f"{label:<40}{seconds:>10.3f}")
+    print(f"\nSIGHUP reload of {args.workers} workers: {reload_seconds:.2f}s, {failures} of {requests} requests failed")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark for the admin views' relative times.
+
+Builds rows with local TEXT timestamps spread over the last year and
+formats "time ago" labels for them the old way, one strptime per row, and
+with clock.time_ago over the epoch-millisecond values. Fails if the two
+disagree on any row.
+
+    python -m benchmarks.time_ago --rows 100000
+"""
+import argparse
+import random
+import sys
+from datetime import datetime
+
+from .common import Timer
+
+
+def legacy_time_ago(texts, now):
+    """The per-row formatting the admin views used to do."""
+    labels = []
+    for text in texts:
+        diff = now - datetime.strptime(text, "%Y-%m-%d %H:%M:%S")
+        days = diff.days
+        seconds = diff.seconds
+        if days >= 30:
+            months = days // 30
+            labels.append(f"{months} month" + ("s" if months > 1 else ""))
+        elif days >= 1:
+            labels.append(f"{days} day" + ("s" if days > 1 else ""))
+        elif seconds >= 3600:
+            hours = seconds // 3600
+            labels.append(f"{hours} hour" + ("s" if hours > 1 else ""))
+        elif seconds >= 60:
+            minutes = seconds // 60
+            labels.append(f"{minutes} minute" + ("s" if minutes > 1 else ""))
+        else:
+            labels.append("just now")
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    from app import clock
+
+    rng = random.Random(7)
+    now_ms = clock.now_ms()
+    # Older rows more often, like a real table
+    texts = [clock.to_text(now_ms - int(rng.expovariate(1 / 86_400_000) * 30) % (365 * 86_400_000)) for _ in range(args.rows)]
+    values = [clock.parse_ms(text) for text in texts]
+    now = datetime.fromtimestamp(now_ms / 1000, clock.LOCAL_TZ).replace(tzinfo=None)
+
+    with Timer() as legacy_timer:
+        expected = legacy_time_ago(texts, now)
+    with Timer() as clock_timer:
+        labels = clock.time_ago(values, now_ms)
+
+    print(f"{'formatter':<30}{'rows/s':>14}")
+    print(f"{'strptime per row':<30}{args.rows / legacy_timer.elapsed:>14.0f}")
+    print(f"{'clock.time_ago':<30}{args.rows / clock_timer.elapsed:>14.0f}")
+
+    mismatched = [(text, old, new) for text, old, new in zip(texts, expected, labels) if old != new]
+    if mismatched:
+        print(f"FAILED: {len(mismatched)} labels differ, e.g. {mismatched[:3]}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark for GET /api/transactions on a large ledger.
+
+Seeds a ledger (1M rows by default) where one "heavy" user takes part in a
+share of all transfers, then compares the old single-query full history
+against the keyset-paginated history (one index-ordered query per side),
+with and without indexes.
+
+    python -m benchmarks.transaction_history --rows 1000000
+"""
+import argparse
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from .common import create_database, seed_users, remove_database, Timer
+
+LEGACY_QUERY = (
+    "SELECT t.id, t.transaction_type, t.amount, t.timestamp, t.status, "
+    "t.sender_id, t.receiver_id, t.note, s.name as sender_name, r.name as receiver_name "
+    "FROM transactions t "
+    "LEFT JOIN users s ON t.sender_id = s.id "
+    "LEFT JOIN users r ON t.receiver_id = r.id "
+    "WHERE "
+    "  (t.sender_id = ? AND t.transaction_type IN ('sent', 'transfer')) "
+    "  OR (t.receiver_id = ? AND t.transaction_type IN ('received', 'transfer', 'redeemed')) "
+    "ORDER BY t.timestamp DESC"
+)
+
+
+def seed_ledger(path, user_ids, rows, heavy_share):
+    rng = random.Random(42)
+    heavy = user_ids[0]
+    start = datetime(2024, 1, 1)
+
+    def generate():
+        for n in range(rows // 2):
+            sender, receiver = rng.sample(user_ids, 2)
+            if rng.random() < heavy_share:
+                if rng.random() < 0.5:
+                    sender = heavy
+                else:
+                    receiver = heavy
+                if sender == receiver:
+                    continue
+            timestamp = (start + timedelta(seconds=n * 30)).strftime('%Y-%m-%d %H:%M:%S')
+            txn_id = f"{n:07X}"
+            amount = rng.randint(1, 500)
+            yield (txn_id, 'sent', sender, receiver, amount, 'completed', '', timestamp)
+            yield (txn_id, 'received', sender, receiver, amount, 'completed', '', timestamp)
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        generate()
+    )
+    conn.commit()
+    conn.close()
+    return heavy
+
+
+def time_call(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        with Timer() as timer:
+            result = fn()
+        best = min(best, timer.elapsed)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--heavy-share', type=float, default=0.02, help='share of transfers involving the heavy user')
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = create_database()
+    user_ids = seed_users(path, args.users)
+    with Timer() as timer:
+        heavy = seed_ledger(path, user_ids, args.rows, args.heavy_share)
+    print(f"seeded {args.rows} ledger rows in {timer.elapsed:.1f}s")
+
+    from app.database import db
+    from app.migrations import migrate
+    from app.api.transactions import query_transaction_history, HISTORY_PAGE_SQL
+
+    light = user_ids[len(user_ids) // 2]
+    results = []
+
+    def run(label, fn):
+        ms, rows = time_call(fn, args.repeat)
+        results.append((label, ms, len(rows)))
+
+    for user_id, who in ((heavy, 'heavy'), (light, 'light')):
+        run(f"legacy full history, no index ({who})", lambda: db.execute(LEGACY_QUERY, user_id, user_id))
+
+    with Timer() as timer:
+        migrate()
+    print(f"built indexes in {timer.elapsed:.1f}s")
+
+    for user_id, who in ((heavy, 'heavy'), (light, 'light')):
+        run(f"legacy full history, indexed ({who})", lambda: db.execute(LEGACY_QUERY, user_id, user_id))
+        run(f"keyset first page ({who})", lambda: query_transaction_history(user_id, None, args.page_size))
+
+    # A page deep into the heavy user's history
+    history = db.execute(LEGACY_QUERY, heavy, heavy)
+    middle = history[len(history) // 2]
+    middle_ms = db.execute("SELECT timestamp_ms FROM transactions WHERE id = ?", middle['id'])[0]['timestamp_ms']
+    run("keyset middle page (heavy)", lambda: query_transaction_history(heavy, (middle_ms, middle['id']), args.page_size))
+
+    print()
+    print(f"{'query':<45}{'best ms':>10}{'rows':>10}")
+    for label, ms, count in results:
+        print(f"{label:<45}{ms:>10.2f}{count:>10}")
+
+    print("\nquery plans for the keyset queries:")
+    for sql in HISTORY_PAGE_SQL:
+        for row in db.execute("EXPLAIN QUERY PLAN " + sql, heavy, middle_ms, middle_ms, middle['id'], 1):
+            print("  " + row['detail'])
+
+    db.close_all()
+    remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
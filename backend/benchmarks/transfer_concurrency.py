@@ -0,0 +1,119 @@
+"""
+Concurrency benchmark for the money transfer path.
+
+Many threads move money between a small set of users with low balances,
+so most transfers race each other for the same accounts. Afterwards the
+script checks that money was neither created nor destroyed, that no
+balance went negative and that every balance matches the ledger.
+
+    python -m benchmarks.transfer_concurrency --threads 8 --transfers 4000
+    python -m benchmarks.transfer_concurrency --legacy   # old check-then-update path
+"""
+import argparse
+import random
+import sys
+import threading
+
+from .common import create_database, seed_users, remove_database, Timer
+
+
+def legacy_transfer(db, sender_id, receiver_id, amount, transaction_id, timestamp, note=''):
+    # The statement sequence send_money used before the transfer engine
+    balance = db.execute("SELECT balance FROM users WHERE id = ?", sender_id)[0]['balance']
+    if balance < amount:
+        return False
+    db.execute("UPDATE users SET balance = balance - ? WHERE id = ?", amount, sender_id)
+    db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", amount, receiver_id)
+    db.execute(
+        "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        transaction_id, 'sent', sender_id, receiver_id, amount, 'completed', note, timestamp
+    )
+    db.execute("SELECT last_insert_rowid() as id")
+    db.execute(
+        "INSERT INTO transactions (transaction_id, transaction_type, sender_id, receiver_id, amount, status, note, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        transaction_id, 'received', sender_id, receiver_id, amount, 'completed', note, timestamp
+    )
+    db.execute("SELECT last_insert_rowid() as id")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=4000, help='total transfer attempts')
+    parser.add_argument('--balance', type=float, default=100.0, help='starting balance per user')
+    parser.add_argument('--amount', type=float, default=30.0, help='amount per transfer')
+    parser.add_argument('--legacy', action='store_true', help='benchmark the old multi-statement path')
+    args = parser.parse_args()
+
+    path = create_database()
+    user_ids = seed_users(path, args.users, args.balance)
+
+    from app.database import db
+    from app.migrations import migrate
+    from app.transfers import transfer, InsufficientBalance
+    migrate()
+
+    counts = {'completed': 0, 'rejected': 0, 'errors': 0}
+    counts_lock = threading.Lock()
+    per_thread = args.transfers // args.threads
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for i in range(per_thread):
+            sender_id, receiver_id = rng.sample(user_ids, 2)
+            transaction_id = f"{seed:03X}{i:04X}"
+            outcome = 'completed'
+            try:
+                if args.legacy:
+                    if not legacy_transfer(db, sender_id, receiver_id, args.amount, transaction_id, '2025-01-01 00:00:00'):
+                        outcome = 'rejected'
+                else:
+                    transfer(sender_id, receiver_id, args.amount, '2025-01-01 00:00:00')
+            except InsufficientBalance:
+                outcome = 'rejected'
+            except Exception:
+                outcome = 'errors'
+            with counts_lock:
+                counts[outcome] += 1
+        db.release()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+    with Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    balances = {row['id']: row['balance'] for row in db.execute("SELECT id, balance FROM users")}
+    ledger = {row['id']: row['delta'] for row in db.execute(
+        "SELECT u.id, "
+        "COALESCE((SELECT SUM(amount) FROM transactions WHERE receiver_id = u.id AND transaction_type = 'received'), 0) - "
+        "COALESCE((SELECT SUM(amount) FROM transactions WHERE sender_id = u.id AND transaction_type = 'sent'), 0) AS delta "
+        "FROM users u"
+    )}
+    db.close_all()
+    remove_database(path)
+
+    total_expected = args.users * args.balance
+    total_actual = sum(balances.values())
+    negative = [user_id for user_id, balance in balances.items() if balance < 0]
+    drifted = [user_id for user_id in balances if abs(args.balance + ledger[user_id] - balances[user_id]) > 1e-6]
+
+    attempts = per_thread * args.threads
+    print(f"mode:              {'legacy' if args.legacy else 'transfer engine'}")
+    print(f"attempts:          {attempts} on {args.threads} threads in {timer.elapsed:.2f}s")
+    print(f"throughput:        {attempts / timer.elapsed:.0f} attempts/s, {counts['completed'] / timer.elapsed:.0f} transfers/s")
+    print(f"completed:         {counts['completed']}, rejected: {counts['rejected']}, errors: {counts['errors']}")
+    print(f"money conserved:   {abs(total_actual - total_expected) < 1e-6} ({total_actual:.2f} / {total_expected:.2f})")
+    print(f"negative balances: {len(negative)}")
+    print(f"ledger drift:      {len(drifted)} users")
+
+    if counts['errors'] or negative or drifted or abs(total_actual - total_expected) > 1e-6:
+        print("FAILED: double spend or lost update detected")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
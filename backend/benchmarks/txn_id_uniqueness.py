@@ -0,0 +1,73 @@
+"""
+Uniqueness stress test for the transaction ID generator.
+
+Several worker processes, each with a few threads, draw IDs from the same
+database at once, the way gunicorn workers would. The script fails if any
+ID repeats or leaves the 7-character hex format.
+
+    python -m benchmarks.txn_id_uniqueness --processes 4 --threads 4 --ids 50000
+"""
+import argparse
+import multiprocessing
+import re
+import sys
+import threading
+
+from .common import create_database, remove_database, Timer
+
+ID_FORMAT = re.compile(r'^[0-9A-F]{7}$')
+
+
+def draw_ids(path, threads, count, block_size):
+    import os
+    os.environ['DATABASE_PATH'] = path
+    from app.txn_ids import TransactionIdGenerator
+    generator = TransactionIdGenerator(path, key=b'stress-test-key', block_size=block_size)
+
+    results = [[] for _ in range(threads)]
+
+    def worker(out):
+        for _ in range(count // threads):
+            out.append(generator.next_id())
+
+    workers = [threading.Thread(target=worker, args=(out,)) for out in results]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return [txn_id for out in results for txn_id in out]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='threads per process')
+    parser.add_argument('--ids', type=int, default=50_000, help='IDs drawn per process')
+    parser.add_argument('--block-size', type=int, default=64)
+    args = parser.parse_args()
+
+    path = create_database()
+    from app.migrations import migrate
+    migrate()
+
+    with Timer() as timer:
+        with multiprocessing.Pool(args.processes) as pool:
+            batches = pool.starmap(draw_ids, [(path, args.threads, args.ids, args.block_size)] * args.processes)
+    remove_database(path)
+
+    ids = [txn_id for batch in batches for txn_id in batch]
+    unique = set(ids)
+    malformed = [txn_id for txn_id in ids if not ID_FORMAT.match(txn_id)]
+
+    print(f"drawn:       {len(ids)} IDs from {args.processes} processes x {args.threads} threads")
+    print(f"elapsed:     {timer.elapsed:.2f}s ({len(ids) / timer.elapsed:.0f} IDs/s)")
+    print(f"duplicates:  {len(ids) - len(unique)}")
+    print(f"malformed:   {len(malformed)}")
+
+    if len(unique) != len(ids) or malformed:
+        print("FAILED")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
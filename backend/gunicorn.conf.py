@@ -0,0 +1,56 @@
+"""
+Gunicorn settings for serving the API in production.
+
+The master imports wsgi:app once (preload_app), so blueprint
+registration and migrations run a single time before the workers are
+forked. Each worker then starts with its own SQLite
+connections, log flusher and notification threads.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+kill -HUP <master> replaces the workers one by one and lets in-flight
+requests finish. New code is only picked up without preloading, or
+through kill -USR2 <master> followed by kill -QUIT of the old master.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Two processes per core plus one, each with a few threads for requests
+# that wait on SQLite locks or password hashing
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then; the jitter keeps them from restarting together
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+def pre_fork(server, worker):
+    # SQLite connections must never cross a fork; close the master's before each one
+    from app.database import db
+    db.close_all()
+
+
+def post_fork(server, worker):
+    # Open the worker's first connection now rather than on its first request
+    from app.database import db
+    db.connection()
+    db.release()
+
+
+def worker_exit(server, worker):
+    # Deliver queued pushes and write buffered log rows before the worker goes away
+    from app.notifications import dispatcher
+    from app.logger import log_buffer
+    dispatcher.shutdown()
+    log_buffer.shutdown()
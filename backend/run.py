@@ -3,6 +3,7 @@ import os
 
 app = create_app()
 
+# Development server only; production runs gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', '1') == '1')
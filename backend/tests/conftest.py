@@ -0,0 +1,60 @@
+import itertools
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+# The app reads its settings at import time, so point it at a throwaway
+# database before anything from `app` is imported
+DATABASE_DIR = tempfile.mkdtemp(prefix='flexpay-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(DATABASE_DIR, 'database.db')
+os.environ['JWT_SECRET'] = 'flexpay-tests-secret-0123456789abcdef'
+os.environ['NOTIFICATION_TRANSPORT'] = 'fake'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ['MIGRATE_ON_STARTUP'] = '1'
+
+_phones = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user():
+    """Insert a user with a unique phone number and return their id."""
+    from app.database import db
+    from app import directory
+
+    def make(balance=1000.0, device_token=None):
+        n = next(_phones)
+        phone = f"03{n:09d}"
+        phone_e164 = directory.normalize_phone(phone)
+        return db.execute(
+            "INSERT INTO users (name, email, phone_number, phone_e164, phone_hash, password, balance, device_token) "
+            "VALUES (?, ?, ?, ?, ?, 'x', ?, ?)",
+            f"Test User {n}", f"user{n}@example.com", phone, phone_e164, directory.hash_phone(phone_e164),
+            balance, device_token
+        )
+    return make
+
+
+@pytest.fixture
+def session_headers():
+    """Request headers carrying a session token for a user."""
+    def headers(user_id, **extra):
+        token = jwt.encode(
+            {'user_id': user_id, 'type': 'session', 'exp': datetime.now(timezone.utc) + timedelta(hours=1)},
+            os.environ['JWT_SECRET'], algorithm='HS256'
+        )
+        return {'Authorization': f'Bearer {token}', **extra}
+    return headers
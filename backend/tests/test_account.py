@@ -0,0 +1,25 @@
+from app.database import db
+from app import qr_scans
+from app.logger import log_event, log_buffer
+
+
+def test_delete_account_removes_qr_scans(client, make_user, session_headers):
+    user_id = make_user()
+    qr_scans.add_scan(user_id, '{"name": "A", "phone": "03001234567"}')
+
+    response = client.delete('/api/account/delete', headers=session_headers(user_id))
+
+    assert response.status_code == 200, response.get_json()
+    assert not db.execute("SELECT id FROM users WHERE id = ?", user_id)
+    assert not db.execute("SELECT id FROM qr_scans WHERE user_id = ?", user_id)
+
+
+def test_delete_account_keeps_audit_logs(client, make_user, session_headers):
+    user_id = make_user()
+    log_event('INFO', f'test event for {user_id}', user_id=user_id)
+    log_buffer.flush()
+
+    response = client.delete('/api/account/delete', headers=session_headers(user_id))
+
+    assert response.status_code == 200, response.get_json()
+    assert db.execute("SELECT user_id FROM logs WHERE message = ?", f'test event for {user_id}') == [{'user_id': None}]
@@ -0,0 +1,82 @@
+import uuid
+
+from app.database import db
+from app.api import transactions
+
+
+def balance(user_id):
+    return db.execute("SELECT balance FROM users WHERE id = ?", user_id)[0]['balance']
+
+
+def receiver_phone(user_id):
+    return db.execute("SELECT phone_number FROM users WHERE id = ?", user_id)[0]['phone_number']
+
+
+def send(client, headers, receiver_id):
+    return client.post(
+        '/api/transactions/send',
+        json={'receiver_phone': receiver_phone(receiver_id), 'amount': 10},
+        headers=headers
+    )
+
+
+def test_retry_after_error_returned_past_commit_does_not_debit_again(client, make_user, session_headers, monkeypatch):
+    sender_id, receiver_id = make_user(), make_user(device_token='device-token')
+    headers = session_headers(sender_id, **{'Idempotency-Key': str(uuid.uuid4())})
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("queue unavailable")
+
+    # send_money's catch-all turns this into a 500 after the transfer committed
+    monkeypatch.setattr(transactions.dispatcher, 'enqueue', fail)
+    first = send(client, headers, receiver_id)
+    monkeypatch.undo()
+    retry = send(client, headers, receiver_id)
+
+    assert first.status_code == 200
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['transaction_id'] == first.get_json()['transaction_id']
+    assert balance(sender_id) == 990
+    assert balance(receiver_id) == 1010
+
+
+def test_retry_after_exception_past_commit_does_not_debit_again(client, make_user, session_headers, monkeypatch):
+    sender_id, receiver_id = make_user(), make_user()
+    headers = session_headers(sender_id, **{'Idempotency-Key': str(uuid.uuid4())})
+    log_event = transactions.log_event
+
+    def failing_log_event(level, message, **kwargs):
+        if level in ('INFO', 'ERROR'):
+            raise RuntimeError("log unavailable")
+        log_event(level, message, **kwargs)
+
+    # Raised after the commit and again from the catch-all, so the handler raises
+    monkeypatch.setattr(transactions, 'log_event', failing_log_event)
+    first = send(client, headers, receiver_id)
+    monkeypatch.undo()
+    retry = send(client, headers, receiver_id)
+
+    assert first.status_code == 500
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert balance(sender_id) == 990
+    assert balance(receiver_id) == 1010
+
+
+def test_retry_after_error_before_commit_runs_again(client, make_user, session_headers, monkeypatch):
+    sender_id, receiver_id = make_user(), make_user()
+    headers = session_headers(sender_id, **{'Idempotency-Key': str(uuid.uuid4())})
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(transactions, 'transfer', fail)
+    first = send(client, headers, receiver_id)
+    monkeypatch.undo()
+    retry = send(client, headers, receiver_id)
+
+    assert first.status_code == 500
+    assert retry.status_code == 200
+    assert 'Idempotent-Replayed' not in retry.headers
+    assert balance(sender_id) == 990
@@ -0,0 +1,37 @@
+import pytest
+from app.migrations import MIGRATIONS, explain, hot_queries
+from app.database import db
+
+
+def test_all_migrations_applied(app):
+    applied = {row[0] for row in db.query("SELECT version FROM schema_migrations", row_factory='tuple')}
+    assert applied == {version for version, _, _ in MIGRATIONS}
+
+
+@pytest.mark.parametrize('name', [name for name, _, _ in hot_queries()])
+def test_hot_query_uses_an_index(app, name):
+    [(_, plan, problems)] = explain([query for query in hot_queries() if query[0] == name])
+    assert not problems, '\n'.join(plan)
+
+
+def test_reread_notification_times_in_server_local_time(app):
+    from app import clock
+    from app.migrations import reread_epoch_ms
+
+    def log(text, ms):
+        return db.execute(
+            "INSERT INTO notification_logs (title, message, target_type, recipient_count, status, sent_at, sent_at_ms) "
+            "VALUES ('t', 'm', 'all', 0, 'sent', ?, ?)", text, ms
+        )
+
+    # Backfilled by migration 12 in TIMEZONE, before it ran
+    legacy_text = '2020-01-01 12:00:00'
+    legacy_id = log(legacy_text, clock.parse_ms(legacy_text))
+    # Written by the app since, with its exact time
+    new_text, new_ms = clock.stamp()
+    new_id = log(new_text, new_ms)
+
+    reread_epoch_ms('notification_logs', 'sent_at', 12)(db)
+
+    rows = {row['id']: row['sent_at_ms'] for row in db.execute("SELECT id, sent_at_ms FROM notification_logs WHERE id IN (?, ?)", legacy_id, new_id)}
+    assert rows == {legacy_id: clock.parse_ms(legacy_text, None), new_id: new_ms}
@@ -35,7 +35,7 @@ export type HomeStackParamList = {
   UserSettings: undefined; // Added
   ChangePassword: undefined; // Added
   TestNotification: undefined; // Added for testing
-  AllTransactions: { transactions: any[], userId: number };
+  AllTransactions: { transactions: any[], nextBefore: string | null, userId: number };
 };
 const Stack = createNativeStackNavigator<HomeStackParamList>();
 
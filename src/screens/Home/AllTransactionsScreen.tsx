@@ -1,17 +1,38 @@
-import React, { useState, useMemo } from 'react';
+import React, { useState, useMemo, useRef } from 'react';
 import { View, Text, StyleSheet, FlatList, TextInput } from 'react-native';
 import { NativeStackScreenProps } from '@react-navigation/native-stack';
 import { RootStackParamList } from '../../navigations/StackNavigator';
 import { colors } from '../../theme/style';
 import { useSafeAreaInsets } from 'react-native-safe-area-context';
 import ScanIcon from '../../assets/icons/scan.svg';
+import api from '../../utils/api';
 
 type Props = NativeStackScreenProps<RootStackParamList, 'AllTransactions'>;
 
 export default function AllTransactionsScreen({ route }: Props) {
-  const { transactions, userId } = route.params;
+  const { userId } = route.params;
   const insets = useSafeAreaInsets();
   const [searchQuery, setSearchQuery] = useState('');
+  const [transactions, setTransactions] = useState<any[]>(route.params.transactions);
+  const [nextBefore, setNextBefore] = useState<string | null>(route.params.nextBefore);
+  const loadingMore = useRef(false);
+
+  // The history is paginated; fetch the next page when the end of the list is reached
+  const loadMore = async () => {
+    if (!nextBefore || loadingMore.current) return;
+    loadingMore.current = true;
+    try {
+      const response = await api(`/api/transactions?before=${encodeURIComponent(nextBefore)}`);
+      if (!response.ok) throw new Error('Failed to fetch transactions');
+      const data = await response.json();
+      setTransactions(previous => [...previous, ...data.transactions]);
+      setNextBefore(data.next_before);
+    } catch (err) {
+      console.error(err);
+    } finally {
+      loadingMore.current = false;
+    }
+  };
 
   const filteredTransactions = useMemo(() => {
     if (!searchQuery) {
@@ -83,6 +104,8 @@ export default function AllTransactionsScreen({ route }: Props) {
         data={filteredTransactions}
         renderItem={renderTransaction}
         keyExtractor={(item) => item.id.toString()}
+        onEndReached={loadMore}
+        onEndReachedThreshold={0.5}
         contentContainerStyle={styles.listContent}
       />
     </View>
@@ -38,6 +38,7 @@ const HomeScreen = () => {
   const [refreshing, setRefreshing] = useState(false);
   const [hasCard, setHasCard] = useState(false);
   const [transactions, setTransactions] = useState<any[]>([]);
+  const [nextBefore, setNextBefore] = useState<string | null>(null);
   const previousBalance = useRef<number | null>(null);
 
   const fetchBalance = async () => {
@@ -75,6 +76,7 @@ const HomeScreen = () => {
       if (!response.ok) throw new Error('Failed to fetch transactions');
       const data = await response.json();
       setTransactions(data.transactions);
+      setNextBefore(data.next_before);
     } catch (err) {
       console.error(err);
     }
@@ -199,7 +201,7 @@ const HomeScreen = () => {
       <View style={styles.transactionSection}>
         <View style={styles.transactionHeader}>
           <Text style={styles.transactionTitle}>Transaction</Text>
-          <TouchableOpacity onPress={() => navigation.navigate('AllTransactions', { transactions, userId: user?.id })}>
+          <TouchableOpacity onPress={() => navigation.navigate('AllTransactions', { transactions, nextBefore, userId: user?.id })}>
             <Text style={styles.seeAll}>See all</Text>
           </TouchableOpacity>
         </View>